@@ -1,54 +1,363 @@
 #!/usr/bin/env python3
+import argparse
 import csv
+import json
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
+from botocore.config import Config
 
-iam = boto3.client("iam")
-sso_region = "us-west-2"
+# Identity Center roles live under /aws-reserved/sso.amazonaws.com/<region>/, older ones
+# without the region; None matches the roles of every region
+sso_region = None
 
+FIELDS = ["Account", "RoleName", "Arn", "PermissionSetName", "LastUsedDate"]
 
-def list_roles():
-    roles = []
-    params = {"PathPrefix": f"/aws-reserved/sso.amazonaws.com/{sso_region}/"}
+
+class CsvWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "w", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        self.writer.writeheader()
+
+    def write(self, row: dict):
+        self.writer.writerow(row)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesWriter:
+    def __init__(self, path: str):
+        self.file = open(path, "w")
+
+    def write(self, row: dict):
+        self.file.write(json.dumps(row) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ArrowWriter:
+    """
+    Writes Parquet or Arrow IPC stream files with pyarrow, batch_size rows at a time.
+
+    A Parquet file is only readable once it is closed; an Arrow stream can be read up to
+    the last batch written.
+    """
+
+    def __init__(self, path: str, parquet: bool, batch_size: int = 10000):
+        try:
+            import pyarrow
+        except ImportError as err:
+            raise RuntimeError(
+                f"writing {path} needs pyarrow: pip install pyarrow"
+            ) from err
+
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([(field, pyarrow.string()) for field in FIELDS])
+        self.batch_size = batch_size
+        self.rows = []
+        if parquet:
+            import pyarrow.parquet
+
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_stream(path, self.schema)
+
+    def write(self, row: dict):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_batch(
+                self.pa.RecordBatch.from_pylist(self.rows, schema=self.schema)
+            )
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+WRITERS = {
+    "csv": CsvWriter,
+    "jsonl": JsonLinesWriter,
+    "parquet": lambda path: ArrowWriter(path, parquet=True),
+    "arrow": lambda path: ArrowWriter(path, parquet=False),
+}
+
+
+def output_format(path: str) -> str:
+    # the format follows the extension of the output file, csv when there is none
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    return {"ndjson": "jsonl", "arrows": "arrow"}.get(extension, extension) or "csv"
+
+
+def iam_client(max_workers: int = 8, session=None):
+    # one client is shared by all workers: a connection per worker, and adaptive retries
+    # that back off and slow the client down when IAM answers with Throttling
+    return (session or boto3).client(
+        "iam",
+        config=Config(
+            max_pool_connections=max_workers,
+            retries={"mode": "adaptive", "max_attempts": 10},
+        ),
+    )
+
+
+def sso_path():
+    if sso_region:
+        return f"/aws-reserved/sso.amazonaws.com/{sso_region}/"
+    return "/aws-reserved/sso.amazonaws.com/"
+
+
+def list_roles(iam):
+    # yields the roles one page at a time
+    params = {"PathPrefix": sso_path()}
     while True:
         response = iam.list_roles(**params)
-        roles += response["Roles"]
+        yield from response["Roles"]
         if marker := response.get("Marker"):
             params["Marker"] = marker
             continue
         break
-    return roles
 
 
-def get_role(role_name):
+def list_role_details(iam):
+    # all roles of the account with their last used data and policies, up to 1000 per
+    # call; the api has no path filter so the sso roles are picked out here
+    params = {"Filter": ["Role"], "MaxItems": 1000}
+    while True:
+        response = iam.get_account_authorization_details(**params)
+        yield from (
+            role
+            for role in response["RoleDetailList"]
+            if role["Path"].startswith(sso_path())
+        )
+        if response.get("IsTruncated"):
+            params["Marker"] = response["Marker"]
+            continue
+        break
+
+
+def get_role(iam, role_name):
     return iam.get_role(RoleName=role_name)
 
 
-def main():
-    account = str(boto3.client("sts").get_caller_identity()["Account"])
-    sso_roles = []
-    for role in list_roles():
+def last_used_date(role) -> str:
+    return str(role.get("RoleLastUsed", {}).get("LastUsedDate", "never"))
+
+
+def with_last_used_dates(iam, roles, max_workers: int = 8):
+    # list_roles does not return RoleLastUsed, so every role is fetched, max_workers at a
+    # time; yields (role, date) in the order of roles and keeps only a few fetches ahead
+    # of the consumer, so memory stays flat however many roles there are
+    def fetch(name):
+        return last_used_date(get_role(iam, name)["Role"])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for role in roles:
+            pending.append((role, executor.submit(fetch, role["RoleName"])))
+            if len(pending) >= max_workers * 4:
+                role, future = pending.popleft()
+                yield role, future.result()
+        while pending:
+            role, future = pending.popleft()
+            yield role, future.result()
+
+
+def account_rows(account: str, iam, bulk: bool, max_workers: int):
+    if bulk:
+        roles = ((role, last_used_date(role)) for role in list_role_details(iam))
+    else:
+        roles = with_last_used_dates(iam, list_roles(iam), max_workers=max_workers)
+    for role, date in roles:
         name = role["RoleName"]
-        sso_roles.append(
-            {
-                "Account": account,
-                "RoleName": name,
-                "Arn": role["Arn"],
-                "PermissionSetName": "_".join(name.split("_")[1:-1]),
-                "LastUsedDate": str(
-                    iam.get_role(RoleName=name)["Role"]["RoleLastUsed"].get(
-                        "LastUsedDate", "never"
-                    )
-                ),
-            }
+        yield {
+            "Account": account,
+            "RoleName": name,
+            "Arn": role["Arn"],
+            "PermissionSetName": "_".join(name.split("_")[1:-1]),
+            "LastUsedDate": date,
+        }
+
+
+def list_accounts(organizations) -> list:
+    accounts = []
+    params = {}
+    while True:
+        response = organizations.list_accounts(**params)
+        accounts += [a["Id"] for a in response["Accounts"] if a["Status"] == "ACTIVE"]
+        if token := response.get("NextToken"):
+            params["NextToken"] = token
+            continue
+        break
+    return accounts
+
+
+def account_session(sts, account: str, role_name: str, partition: str = "aws"):
+    credentials = sts.assume_role(
+        RoleArn=f"arn:{partition}:iam::{account}:role/{role_name}",
+        RoleSessionName="britive-identity-center-export",
+    )["Credentials"]
+    return boto3.Session(
+        aws_access_key_id=credentials["AccessKeyId"],
+        aws_secret_access_key=credentials["SecretAccessKey"],
+        aws_session_token=credentials["SessionToken"],
+    )
+
+
+def collect_organization(
+    writer,
+    role_name: str,
+    bulk: bool,
+    max_workers: int,
+    account_workers: int,
+) -> list:
+    # every account of the organization is collected with its own assumed role session,
+    # account_workers at a time; rows are written as they come, so the rows of accounts
+    # collected at the same time are interleaved
+    sts = boto3.client("sts")
+    caller = sts.get_caller_identity()
+    caller_account = str(caller["Account"])
+    partition = caller["Arn"].split(":")[1]
+    accounts = list_accounts(boto3.client("organizations"))
+    print(f"collecting {len(accounts)} accounts", file=sys.stderr)
+    lock = threading.Lock()
+
+    def collect(account):
+        # the account running the export is read with its own credentials
+        session = (
+            None
+            if account == caller_account
+            else account_session(sts, account, role_name, partition)
         )
+        iam = iam_client(max_workers=max_workers, session=session)
+        count = 0
+        for row in account_rows(account, iam, bulk=bulk, max_workers=max_workers):
+            with lock:
+                writer.write(row)
+            count += 1
+        with lock:
+            writer.flush()
+        return count
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=account_workers) as executor:
+        futures = {executor.submit(collect, account): account for account in accounts}
+        for done, future in enumerate(as_completed(futures), start=1):
+            account = futures[future]
+            try:
+                count = future.result()
+            except Exception as e:
+                failed.append(account)
+                print(f"{account}: {e}", file=sys.stderr)
+                continue
+            print(f"[{done}/{len(accounts)}] {account}: {count} roles", file=sys.stderr)
+    return failed
+
+
+def main():
+    global sso_region
+
+    parser = argparse.ArgumentParser(
+        description="Export the AWS Identity Center roles of the account, or of every account of the organization, to a CSV, JSON Lines, Parquet or Arrow file."
+    )
+    parser.add_argument(
+        "-w",
+        "--max-workers",
+        default=8,
+        type=int,
+        help="Number of roles to fetch concurrently.",
+    )
+    parser.add_argument(
+        "-b",
+        "--bulk",
+        action="store_true",
+        help="Read all roles with get_account_authorization_details in a few calls instead of one call per role.",
+    )
+    parser.add_argument(
+        "-r",
+        "--sso-region",
+        help="Only export the Identity Center roles of this region. Defaults to every region.",
+    )
+    parser.add_argument(
+        "--org",
+        action="store_true",
+        help="Export the roles of every active account of the AWS Organization.",
+    )
+    parser.add_argument(
+        "--role-name",
+        default="OrganizationAccountAccessRole",
+        help="Role to assume in every member account in --org mode.",
+    )
+    parser.add_argument(
+        "-a",
+        "--account-workers",
+        default=8,
+        type=int,
+        help="Number of accounts to collect concurrently in --org mode.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="File to write. Defaults to <account>.<format>, or <organization id>.<format> in --org mode.",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=sorted(WRITERS),
+        help="Output format. Defaults to the extension of --output, or csv.",
+    )
+    args = parser.parse_args()
+    sso_region = args.sso_region
+    file_format = args.format or output_format(args.output or "")
+    if file_format not in WRITERS:
+        parser.error(f"unknown output format {file_format}, use --format")
+
+    if args.org:
+        organization = boto3.client("organizations").describe_organization()
+        output = args.output or f"{organization['Organization']['Id']}.{file_format}"
+    else:
+        account = str(boto3.client("sts").get_caller_identity()["Account"])
+        output = args.output or f"{account}.{file_format}"
 
-    with open(f"{account}.csv", "w") as csv_file:
-        csv_writer = csv.writer(csv_file)
-        header = sso_roles[0].keys()
-        csv_writer.writerow(header)
-        for item in sso_roles:
-            csv_writer.writerow(item.values())
+    # the writer is closed on errors and Ctrl+C too, so the rows written so far are kept
+    writer = WRITERS[file_format](output)
+    try:
+        if args.org:
+            failed = collect_organization(
+                writer,
+                role_name=args.role_name,
+                bulk=args.bulk,
+                max_workers=args.max_workers,
+                account_workers=args.account_workers,
+            )
+        else:
+            failed = []
+            iam = iam_client(max_workers=args.max_workers)
+            for row in account_rows(
+                account, iam, bulk=args.bulk, max_workers=args.max_workers
+            ):
+                writer.write(row)
+    finally:
+        writer.close()
+    if failed:
+        sys.exit(f"{len(failed)} accounts failed: {', '.join(sorted(failed))}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for britive/setup.py and gws_scim/scan_scim.py.
+
+Every run starts a fresh fake Britive API (see fake_britive.py), generates a tenant of
+the requested size and runs the unchanged script against it in a child process.
+Reports objects/sec and the p50/p99 latency of the API calls as seen by the server.
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_britive import FakeBritiveServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.dirname(BENCH_DIR)
+SETUP_SCRIPT = os.path.join(PYTHON_DIR, "britive", "setup.py")
+SCIM_SCRIPT = os.path.join(PYTHON_DIR, "gws_scim", "scan_scim.py")
+
+# Runs a script as __main__ after pointing the Britive SDK at the fake server
+BOOTSTRAP = """
+import runpy, sys
+sys.path.insert(0, {bench_dir!r})
+import fake_britive
+fake_britive.point_sdk_at({address!r})
+sys.argv = [{script!r}] + {args!r}
+runpy.run_path({script!r}, run_name="__main__")
+"""
+
+
+def run_script(server, script: str, args: list, workdir: str, env: dict) -> tuple:
+    code = BOOTSTRAP.format(
+        bench_dir=BENCH_DIR, address=server.address, script=script, args=args
+    )
+    log_path = os.path.join(workdir, "output.log")
+    with open(log_path, "w") as log:
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=workdir,
+            env={
+                **os.environ,
+                "BRITIVE_TENANT": "bench",
+                "BRITIVE_API_TOKEN": "bench-token",
+                **env,
+            },
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        elapsed = time.perf_counter() - start
+    return result.returncode, elapsed, log_path
+
+
+def bench_setup(server, size: int, workdir: str, extra_args: list) -> tuple:
+    # size users spread over size / 100 tags
+    tags = max(1, size // 100)
+    data = {
+        "users": [
+            {
+                "email": f"user{i}@example.com",
+                "firstname": "User",
+                "lastname": str(i),
+                "username": f"user{i}@example.com",
+                "idp": "Britive",
+            }
+            for i in range(size)
+        ],
+        "tags": [{"name": f"tag-{i}", "description": ""} for i in range(tags)],
+    }
+    os.makedirs(os.path.join(workdir, "britive"), exist_ok=True)
+    data_file = os.path.join(workdir, "britive", "data_input.json")
+    with open(data_file, "w") as f:
+        json.dump(data, f)
+    args = ["--users", "--tags", "--file", data_file, "--cache-ttl", "0"] + extra_args
+    expected = {"users": size, "tags": tags, "memberships": 0}
+    return expected, run_script(server, SETUP_SCRIPT, args, workdir, {})
+
+
+def bench_scim(server, size: int, workdir: str, extra_args: list) -> tuple:
+    groups = max(1, size // 100)
+    server.tenant.seed_scim_app(
+        app_id="scim-app", idp_id="scim-idp", users=size, groups=groups
+    )
+    env = {
+        "APP_GROUP": "britive-all",
+        "GROUP_PREFIX": "britive-",
+        "APP_ID": "scim-app",
+        "IDP_ID": "scim-idp",
+    }
+    args = ["--no-confirm", "-n", str(size)] + extra_args
+    # every scanned group, the app users group included, becomes a tag with its members
+    scanned = server.tenant.scan_groups["scim-app"].values()
+    expected = {
+        "users": size,
+        "tags": len(scanned),
+        "memberships": sum(len(group["accounts"]) for group in scanned),
+    }
+    return expected, run_script(server, SCIM_SCRIPT, args, workdir, env)
+
+
+def created(tenant) -> dict:
+    # what the run left in the fake tenant, which starts without users and tags
+    return {
+        "users": len(tenant.users),
+        "tags": len(tenant.tags),
+        "memberships": sum(len(user["tags"]) for user in tenant.users.values()),
+    }
+
+
+TARGETS = {"setup": bench_setup, "scim": bench_scim}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the onboarding scripts against a local fake Britive API."
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000],
+        help="Number of users per run (default 1000 10000)",
+    )
+    parser.add_argument(
+        "-t", "--targets", nargs="+", choices=sorted(TARGETS), default=sorted(TARGETS)
+    )
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument(
+        "--error-status",
+        type=int,
+        default=500,
+        help="Status of the injected errors (default 500)",
+    )
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--rate-limit", type=int, default=0)
+    parser.add_argument(
+        "--setup-args",
+        default="",
+        help='Extra arguments for setup.py, e.g. "--bulk --parallel -c 16"',
+    )
+    parser.add_argument(
+        "--scim-args", default="", help="Extra arguments for scan_scim.py"
+    )
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    extra_args = {
+        "setup": shlex.split(args.setup_args),
+        "scim": shlex.split(args.scim_args),
+    }
+    results = []
+    print(
+        f"{'target':<8}{'size':>9}{'objects':>10}{'seconds':>10}{'obj/s':>10}"
+        f"{'calls':>10}{'p50 ms':>10}{'p99 ms':>10}  status"
+    )
+    for target in args.targets:
+        for size in args.sizes:
+            server = FakeBritiveServer(
+                latency_ms=args.latency_ms,
+                jitter_ms=args.jitter_ms,
+                error_rate=args.error_rate,
+                error_status=args.error_status,
+                throttle_rate=args.throttle_rate,
+                rate_limit=args.rate_limit,
+            ).start()
+            with tempfile.TemporaryDirectory() as workdir:
+                expected, (returncode, elapsed, log_path) = TARGETS[target](
+                    server, size, workdir, extra_args[target]
+                )
+                with open(log_path) as log:
+                    tail = log.read()[-2000:]
+            server.stop()
+            summary = server.summary()
+            counts = created(server.tenant)
+            objects = sum(counts.values())
+            missing = {k: v - counts[k] for k, v in expected.items() if counts[k] < v}
+            # a run that exits non-zero or falls short of the expected objects has no
+            # throughput, however fast it was
+            failed = bool(returncode or missing)
+            if returncode:
+                status = f"exit {returncode}"
+            elif missing:
+                status = "missing " + ", ".join(f"{v} {k}" for k, v in missing.items())
+            else:
+                status = "ok"
+            result = {
+                "target": target,
+                "size": size,
+                "objects": objects,
+                "created": counts,
+                "expected": expected,
+                "seconds": round(elapsed, 3),
+                "objects_per_second": None if failed else round(objects / elapsed, 1),
+                "returncode": returncode,
+                "status": status,
+                **summary,
+            }
+            results.append(result)
+            throughput = "-" if failed else f"{result['objects_per_second']:.1f}"
+            print(
+                f"{target:<8}{size:>9}{objects:>10}{elapsed:>10.1f}"
+                f"{throughput:>10}{summary['calls']:>10}"
+                f"{summary['p50_ms']:>10.1f}{summary['p99_ms']:>10.1f}  {status}"
+            )
+            if failed:
+                print(tail)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark for the collect and diff phases of gws_scim/scan_scim.py.
+
+Runs ScanScim in process against a synthetic tenant served by a fake Britive client,
+so no API, network or credentials are needed. Every size is run twice: once to time
+the phases and once under tracemalloc to measure the peak memory of each phase, as
+tracing slows Python down too much to time it at the same time.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "gws_scim"))
+
+from scan_scim import ScanScim, collect_tenant_snapshot  # noqa: E402
+
+APP_ID = "bench-app"
+IDP_ID = "bench-idp"
+APP_GROUP = "britive-all"
+GROUP_PREFIX = "britive-"
+USERS_URL = "https://bench.britive-app.com/api/users"
+
+PHASES = ("tenant_snapshot", "collect_scan", "collect_tenant", "diff")
+
+
+class SyntheticTenant:
+    """
+    A generated application scan and Britive tenant of a given size.
+
+    Only indexes are kept; the records are built on every call like the SDK decodes
+    them from JSON, so their memory counts against the phase that requests them.
+    """
+
+    def __init__(
+        self,
+        users: int,
+        groups: int,
+        groups_per_user: int = 3,
+        local_users: float = 0.01,
+        synced: float = 0.9,
+        case_mismatch: float = 0.05,
+        inactive: float = 0.01,
+        stale: float = 0.02,
+        drift: float = 0.05,
+        seed: int = 0,
+    ):
+        rng = random.Random(seed)
+        self.users = users
+        self.groups = [APP_GROUP] + [f"{GROUP_PREFIX}group-{g}" for g in range(groups)]
+        per_user = min(groups_per_user, groups)
+        # group indexes of every application user, in the scan and in the tenant
+        self.scan_groups = [
+            tuple(rng.sample(range(1, groups + 1), per_user)) for _ in range(users)
+        ]
+        self.members = [[] for _ in self.groups]
+        self.members[0] = list(range(users))
+        for i, user_groups in enumerate(self.scan_groups):
+            for g in user_groups:
+                self.members[g].append(i)
+
+        # tenant records: (username, idp, status, group indexes)
+        self.tenant = []
+        for i in range(users):
+            draw = rng.random()
+            if draw < local_users:
+                self.tenant.append((self.username(i), "Britive", "active", ()))
+            elif draw < local_users + synced:
+                username = self.username(i)
+                if rng.random() < case_mismatch:
+                    username = username.capitalize()
+                status = "inactive" if rng.random() < inactive else "active"
+                user_groups = self.scan_groups[i]
+                if rng.random() < drift:
+                    user_groups = user_groups[1:] + (rng.randint(1, groups),)
+                # the application users group is synced as a tag too
+                self.tenant.append((username, IDP_ID, status, (0,) + user_groups))
+        for i in range(int(users * stale)):
+            self.tenant.append((f"stale{i}@example.com", IDP_ID, "active", (1,)))
+
+    @staticmethod
+    def username(i: int) -> str:
+        return f"user{i}@example.com"
+
+    def tenant_page(self, page: int, size: int) -> dict:
+        return {
+            "count": len(self.tenant),
+            "page": page,
+            "size": size,
+            "data": [
+                {
+                    "userId": f"u-{n:09d}",
+                    "username": username,
+                    "email": username,
+                    "firstName": "User",
+                    "lastName": str(n),
+                    "status": status,
+                    "type": "User",
+                    "identityProvider": {
+                        "id": idp if idp != "Britive" else "britive-idp",
+                        "name": "Google Workspace" if idp == IDP_ID else idp,
+                    },
+                    "userTags": [
+                        {"userTagId": f"t-{g:06d}", "name": self.groups[g]}
+                        for g in groups
+                    ],
+                }
+                for n, (username, idp, status, groups) in enumerate(
+                    self.tenant[page * size : (page + 1) * size], start=page * size
+                )
+            ],
+        }
+
+    def tags(self) -> list:
+        return [
+            {
+                "userTagId": f"t-{g:06d}",
+                "name": name,
+                "userTagIdentityProviders": [
+                    {"identityProvider": {"id": "britive-idp", "name": "Britive"}}
+                ],
+            }
+            for g, name in enumerate(self.groups)
+        ]
+
+    def app_groups(
+        self, application_id: str, include_associations: bool = True
+    ) -> list:
+        return [
+            {
+                "appPermissionId": str(g),
+                "name": name,
+                "type": "group",
+                "description": name,
+                "scanStatus": "New",
+            }
+            for g, name in enumerate(self.groups)
+        ]
+
+    def group_accounts(self, group_id: str, application_id: str) -> list:
+        return [{"accountName": self.username(i)} for i in self.members[int(group_id)]]
+
+    def accounts(self, application_id: str, include_associations: bool = True) -> list:
+        return [
+            {
+                "type": "user",
+                "nativeName": self.username(i),
+                "firstName": "User",
+                "lastName": str(i),
+            }
+            for i in range(self.users)
+        ]
+
+
+class FakeBritive:
+    """Just enough of the Britive client for ScanScim to collect and diff offline."""
+
+    def __init__(self, tenant: SyntheticTenant):
+        self.tenant = tenant
+        self.session = SimpleNamespace(hooks={"response": []})
+        self.identity_management = SimpleNamespace(
+            users=SimpleNamespace(base_url=USERS_URL),
+            tags=SimpleNamespace(list=tenant.tags),
+        )
+        self.application_management = SimpleNamespace(
+            groups=SimpleNamespace(
+                list=tenant.app_groups, accounts=tenant.group_accounts
+            ),
+            accounts=SimpleNamespace(list=tenant.accounts),
+        )
+
+    def get(self, url: str, params: dict = None, pagination: str = "inline"):
+        if url != USERS_URL or pagination != "none":
+            raise NotImplementedError(f"GET {url} is not part of the benchmark")
+        return self.tenant.tenant_page(params["page"], params["size"])
+
+
+def run_phases(tenant: SyntheticTenant, trace: bool) -> dict:
+    scim = ScanScim(
+        application_users_group_name=APP_GROUP,
+        britive_group_prefix=GROUP_PREFIX,
+        application_id=APP_ID,
+        identity_provider_id=IDP_ID,
+        britive=FakeBritive(tenant),
+    )
+    snapshot = None
+
+    def tenant_snapshot():
+        nonlocal snapshot
+        snapshot = collect_tenant_snapshot(scim.b, {IDP_ID})
+
+    steps = {
+        "tenant_snapshot": tenant_snapshot,
+        "collect_scan": lambda: scim.collect_scan_data(snapshot=snapshot),
+        "collect_tenant": lambda: scim.collect_tenant_data(snapshot=snapshot),
+        "diff": scim.diff,
+    }
+    results = {}
+    for phase in PHASES:
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        steps[phase]()
+        seconds = time.perf_counter() - start
+        results[phase] = {"seconds": round(seconds, 3)}
+        if trace:
+            current, peak = tracemalloc.get_traced_memory()
+            results[phase]["peak_mb"] = round((peak - before) / 2**20, 1)
+            results[phase]["retained_mb"] = round((current - before) / 2**20, 1)
+    results["tenant_snapshot"]["objects"] = len(snapshot.users) + len(snapshot.tags)
+    for phase in ("collect_scan", "collect_tenant", "diff"):
+        results[phase]["objects"] = scim.phases[phase]["objects"]
+    return results
+
+
+def compare(results: list, baseline_file: str, tolerance: float) -> list:
+    # phases of the same size that got slower or bigger than the baseline allows
+    with open(baseline_file) as f:
+        baseline = {(r["size"], r["phase"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get((r["size"], r["phase"]))
+        if not base:
+            continue
+        for key in ("seconds", "peak_mb"):
+            # tiny values are all noise
+            if r[key] > max(base[key] * (1 + tolerance), base[key] + 0.05):
+                regressions.append(
+                    f"{r['phase']} at {r['size']} users: {key} {base[key]} -> {r[key]}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure how the ScanScim collect and diff phases scale, offline."
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000, 500000],
+        help="Number of application users per run (default 1000 10000 100000 500000)",
+    )
+    parser.add_argument(
+        "--groups",
+        type=int,
+        help="Number of prefixed groups (default one per 100 users)",
+    )
+    parser.add_argument("--groups-per-user", type=int, default=3)
+    parser.add_argument(
+        "--local-users",
+        type=float,
+        default=0.01,
+        help="Share of the application users that are local Britive users",
+    )
+    parser.add_argument(
+        "--synced",
+        type=float,
+        default=0.9,
+        help="Share of the application users already in the tenant",
+    )
+    parser.add_argument(
+        "--case-mismatch",
+        type=float,
+        default=0.05,
+        help="Share of the tenant users whose username differs in case",
+    )
+    parser.add_argument(
+        "--inactive",
+        type=float,
+        default=0.01,
+        help="Share of the tenant users that are inactive",
+    )
+    parser.add_argument(
+        "--stale",
+        type=float,
+        default=0.02,
+        help="Tenant users that left the application, as a share of the size",
+    )
+    parser.add_argument(
+        "--drift",
+        type=float,
+        default=0.05,
+        help="Share of the tenant users with a tag that differs from the scan",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Only time the phases, skip the tracemalloc run",
+    )
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument(
+        "--baseline", help="JSON output of an earlier run to compare against"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown or memory growth against the baseline (default 0.25)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    params = {
+        key: getattr(args, key)
+        for key in (
+            "groups_per_user",
+            "local_users",
+            "synced",
+            "case_mismatch",
+            "inactive",
+            "stale",
+            "drift",
+            "seed",
+        )
+    }
+    results = []
+    print(f"{'size':>9}  {'phase':<16}{'objects':>10}{'seconds':>10}{'peak MB':>10}")
+    for size in args.sizes:
+        groups = args.groups or max(1, size // 100)
+        tenant = SyntheticTenant(users=size, groups=groups, **params)
+        timed = run_phases(tenant, trace=False)
+        traced = {}
+        if not args.no_memory:
+            tracemalloc.start()
+            traced = run_phases(tenant, trace=True)
+            tracemalloc.stop()
+        for phase in PHASES:
+            result = {
+                "size": size,
+                "groups": groups,
+                "phase": phase,
+                "objects": timed[phase]["objects"],
+                "seconds": timed[phase]["seconds"],
+                "peak_mb": traced.get(phase, {}).get("peak_mb", 0.0),
+                "retained_mb": traced.get(phase, {}).get("retained_mb", 0.0),
+            }
+            results.append(result)
+            print(
+                f"{size:>9}  {phase:<16}{result['objects']:>10}"
+                f"{result['seconds']:>10.2f}{result['peak_mb']:>10.1f}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "params": params,
+                    "python": sys.version.split()[0],
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Regression check for the diff of gws_scim/scan_scim.py.
+
+Compares ScanScim._compute_diff with the list-based diff it replaced on randomized
+scan and tenant data, with usernames and group names that only differ in case. The
+reference is quadratic, so the inputs are kept small and many runs are made instead.
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "gws_scim"))
+
+from scan_scim import ScanScim, TenantUser  # noqa: E402
+
+# letters whose lower case is special, e.g. "ß" has no upper case and "İ" lowers to two
+# characters, next to plain ascii
+LETTERS = "abcdeABCDEßẞİıK"
+
+
+def random_name(rng: random.Random, prefix: str = "") -> str:
+    return prefix + "".join(rng.choice(LETTERS) for _ in range(rng.randint(1, 4)))
+
+
+def case_variant(rng: random.Random, name: str) -> str:
+    return "".join(c.upper() if rng.random() < 0.5 else c.lower() for c in name)
+
+
+def random_scim(rng: random.Random, users: int, groups: int) -> ScanScim:
+    scim = ScanScim(
+        application_users_group_name="check-all",
+        britive_group_prefix="check-",
+        application_id="check-app",
+        identity_provider_id="check-idp",
+        britive=SimpleNamespace(session=SimpleNamespace(hooks={"response": []})),
+    )
+    # usernames are drawn from a small pool, so both sides share names in different case
+    pool = [random_name(rng) + "@example.com" for _ in range(users)]
+    for _ in range(users):
+        name = case_variant(rng, rng.choice(pool))
+        scim.scan_users[name] = {"username": name}
+    for _ in range(users):
+        name = case_variant(rng, rng.choice(pool))
+        scim.tenant_users[name] = TenantUser(
+            username=name,
+            user_id=name,
+            status=rng.choice(("active", "inactive")),
+            idp_id="check-idp",
+        )
+
+    group_pool = [random_name(rng, prefix="check-") for _ in range(groups)]
+    for _ in range(groups):
+        name = case_variant(rng, rng.choice(group_pool))
+        # group members may repeat, the diff keeps duplicates
+        members = [rng.choice(list(scim.scan_users)) for _ in range(rng.randint(0, 20))]
+        scim.scan_groups[name] = {"description": name, "users": members}
+    for _ in range(groups):
+        name = case_variant(rng, rng.choice(group_pool))
+        members = [
+            case_variant(rng, rng.choice(pool)) for _ in range(rng.randint(0, 20))
+        ]
+        scim.tenant_groups[name] = {"id": name, "users": members}
+    return scim
+
+
+def reference_diff(source, compare):
+    # the _diff of scan_scim.py before it used a set
+    lower_compare = [i.lower() for i in compare]
+    return [i for i in source if i.lower() not in lower_compare]
+
+
+def reference_changes(scim: ScanScim) -> dict:
+    # the diff of scan_scim.py before it used sets, for a full sync
+    active_users = [u for u, v in scim.tenant_users.items() if v.status == "active"]
+    lower_scan_users = [i.lower() for i in scim.scan_users]
+    changes = {
+        "users_to_create": reference_diff(scim.scan_users, scim.tenant_users),
+        "users_to_disable": reference_diff(active_users, scim.scan_users),
+        "users_to_enable": [
+            u
+            for u, v in scim.tenant_users.items()
+            if v.status == "inactive" and u.lower() in lower_scan_users
+        ],
+        "tags_to_create": reference_diff(scim.scan_groups, scim.tenant_groups),
+        "entitlements_to_create": {},
+        "entitlements_to_remove": {},
+    }
+    for group, details in scim.scan_groups.items():
+        tag_users = scim.tenant_groups.get(group, {}).get("users", [])
+        users = reference_diff(details["users"], tag_users)
+        if users:
+            changes["entitlements_to_create"][group] = users
+    for tag, details in scim.tenant_groups.items():
+        scan_users = scim.scan_groups.get(tag, {}).get("users", [])
+        users = reference_diff(details["users"], scan_users)
+        if users:
+            changes["entitlements_to_remove"][tag] = users
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the ScanScim diff against the list-based diff it replaced."
+    )
+    parser.add_argument("-r", "--runs", type=int, default=200)
+    parser.add_argument("-u", "--users", type=int, default=300)
+    parser.add_argument("-g", "--groups", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    rng = random.Random(args.seed)
+    changes = 0
+    for run in range(args.runs):
+        scim = random_scim(rng, users=args.users, groups=args.groups)
+        expected = reference_changes(scim)
+        scim.diff()
+        for key, value in expected.items():
+            actual = getattr(scim, key)
+            if actual != value:
+                print(
+                    f"run {run}: {key} differs\n  expected {value}\n  actual   {actual}"
+                )
+                sys.exit(1)
+        changes += scim.change_count()
+    print(f"{args.runs} runs, {changes} changes, identical to the list-based diff")
+
+
+if __name__ == "__main__":
+    main()
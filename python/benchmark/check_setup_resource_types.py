@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Regression check for the resource types of britive/setup.py --apply.
+
+The resource types of data_input-template.json use the same resource and broker profile
+names under several types, e.g. Server01 under LinuxSSH and WindowsRDP. The check first
+creates every other type with its children, then runs --apply with all types twice
+against the same fake tenant, and checks that every type ends up with each of its
+children exactly once.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from collections import Counter
+
+from bench_onboarding import PYTHON_DIR, SETUP_SCRIPT, run_script
+from fake_britive import FakeBritiveServer
+
+TEMPLATE = os.path.join(PYTHON_DIR, "britive", "data_input-template.json")
+
+
+def apply(server, rts: list, workdir: str) -> None:
+    data_file = os.path.join(workdir, "data_input.json")
+    with open(data_file, "w") as f:
+        json.dump({"resourcesTypes": rts}, f)
+    args = ["--resourceTypes", "--apply", "--file", data_file, "--cache-ttl", "0"]
+    returncode, _, log_path = run_script(server, SETUP_SCRIPT, args, workdir, {})
+    if returncode:
+        with open(log_path) as log:
+            print(log.read()[-2000:])
+        sys.exit(f"setup.py exited with {returncode}")
+
+
+def tenant_children(tenant) -> Counter:
+    # (resource type name, kind, child name) of every child in the tenant
+    rt_names = {rt_id: rt["name"] for rt_id, rt in tenant.resource_types.items()}
+    children = Counter()
+    for perm in tenant.permissions.values():
+        children[(rt_names[perm["resourceTypeId"]], "permissions", perm["name"])] += 1
+    for resource in tenant.resources.values():
+        rt_name = rt_names[resource["resourceType"]["id"]]
+        children[(rt_name, "resources", resource["name"])] += 1
+    for profile in tenant.broker_profiles.values():
+        for association in profile["associations"]:
+            rt_name = association["Resource-Type"]
+            children[(rt_name, "profiles", profile["name"])] += 1
+    return children
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that setup.py --apply keeps the children of each resource type apart."
+    )
+    parser.add_argument("-f", "--file", default=TEMPLATE)
+    args = parser.parse_args()
+
+    with open(args.file) as f:
+        rts = json.load(f)["resourcesTypes"]
+    expected = Counter(
+        (rt["name"], kind, child["name"])
+        for rt in rts
+        for kind in ("permissions", "resources", "profiles")
+        for child in rt.get(kind) or []
+    )
+    repeated = {
+        name
+        for name, count in Counter(
+            (kind, child["name"])
+            for rt in rts
+            for kind in ("resources", "profiles")
+            for child in rt.get(kind) or []
+        ).items()
+        if count > 1
+    }
+    if not repeated:
+        sys.exit(f"{args.file} has no resource or profile name used by several types")
+
+    server = FakeBritiveServer().start()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # every other type first, so the rest finds its names under another type
+            apply(server, rts[::2], workdir)
+            for run in (1, 2):
+                apply(server, rts, workdir)
+                actual = tenant_children(server.tenant)
+                if actual != expected:
+                    for child in sorted(set(actual) | set(expected)):
+                        if actual[child] != expected[child]:
+                            print(
+                                f"  {child}: {actual[child]} in the tenant, "
+                                f"{expected[child]} expected"
+                            )
+                    sys.exit(f"run {run}: the tenant differs from {args.file}")
+    finally:
+        server.stop()
+    print(
+        f"{len(rts)} resource types, {len(expected)} children, "
+        f"{len(repeated)} names used by several types: every child created once"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,825 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Britive API, implementing the endpoints called by
+britive/setup.py and gws_scim/scan_scim.py. It keeps the tenant in memory and can
+add latency, inject errors and throttle with 429 responses.
+
+Run it on its own with `python benchmark/fake_britive.py --port 8080` or start it
+from a benchmark with `FakeBritiveServer(...).start()`.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from requests.adapters import HTTPAdapter
+
+CATALOG = [
+    "AWS",
+    "AWS Standalone",
+    "Azure",
+    "Britive",
+    "GCP",
+    "Google Workspace",
+    "Okta",
+    "Oracle Cloud Infrastructure",
+    "Snowflake",
+]
+BRITIVE_IDP_ID = "britive-idp"
+
+
+def new_id() -> str:
+    return uuid.uuid4().hex[:20]
+
+
+class FakeTenant:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idps = {
+            BRITIVE_IDP_ID: {
+                "id": BRITIVE_IDP_ID,
+                "name": "Britive",
+                "description": "",
+                "ssoProvider": "Generic",
+                "scimProvider": "Generic",
+            }
+        }
+        self.users = {}
+        self.tags = {}
+        self.apps = {}
+        self.environments = {}
+        self.profiles = {}
+        self.notification_mediums = {}
+        self.pools = {}
+        self.resource_types = {}
+        self.permissions = {}
+        self.resources = {}
+        self.broker_profiles = {}
+        self.scan_groups = {}
+        self.scan_accounts = {}
+        self.scan_tasks = {}
+        self.scan_seconds = 0.0
+
+    def add_idp(self, name: str, idp_id: str = None) -> dict:
+        idp = {
+            "id": idp_id or new_id(),
+            "name": name,
+            "description": "",
+            "ssoProvider": "Generic",
+            "scimProvider": "Generic",
+            "ssoConfig": {"entityId": f"https://fake/{name}"},
+        }
+        self.idps[idp["id"]] = idp
+        return idp
+
+    def add_app(self, name: str, catalog_name: str, app_id: str = None) -> dict:
+        app = {
+            "appContainerId": app_id or new_id(),
+            "catalogAppDisplayName": name,
+            "catalogAppName": catalog_name,
+            "rootEnvironmentGroup": {
+                "environmentGroups": [
+                    {"id": "root", "name": "root", "parentId": "", "type": "group"}
+                ]
+            },
+        }
+        self.apps[app["appContainerId"]] = app
+        self.environments[app["appContainerId"]] = []
+        self.profiles[app["appContainerId"]] = []
+        return app
+
+    def seed_scim_app(
+        self,
+        app_id: str,
+        idp_id: str,
+        users: int,
+        groups: int,
+        groups_per_user: int = 2,
+        app_group: str = "britive-all",
+        group_prefix: str = "britive-",
+        seed: int = 0,
+    ) -> None:
+        # Builds a scanned Google Workspace style app: every user is an account in the
+        # app users group and in a few prefixed groups
+        rng = random.Random(seed)
+        self.add_idp("Google Workspace", idp_id=idp_id)
+        self.add_app("Google Workspace", "Google Workspace", app_id=app_id)
+        usernames = [f"user{i}@example.com" for i in range(users)]
+        self.scan_accounts[app_id] = [
+            {
+                "type": "user",
+                "nativeName": username,
+                "firstName": "User",
+                "lastName": str(i),
+            }
+            for i, username in enumerate(usernames)
+        ]
+        group_names = [app_group] + [f"{group_prefix}group-{g}" for g in range(groups)]
+        members = {name: [] for name in group_names}
+        members[app_group] = list(usernames)
+        for username in usernames:
+            for name in rng.sample(group_names[1:], min(groups_per_user, groups)):
+                members[name].append(username)
+        self.scan_groups[app_id] = {
+            str(i): {
+                "appPermissionId": str(i),
+                "name": name,
+                "type": "group",
+                "description": name,
+                "scanStatus": "New",
+                "accounts": [{"accountName": u} for u in members[name]],
+            }
+            for i, name in enumerate(group_names)
+        }
+
+
+class FakeBritiveServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+    def __init__(
+        self,
+        address: tuple = ("127.0.0.1", 0),
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        error_rate: float = 0,
+        error_status: int = 500,
+        throttle_rate: float = 0,
+        rate_limit: int = 0,
+        tenant: FakeTenant = None,
+    ):
+        super().__init__(address, FakeBritiveHandler)
+        self.tenant = tenant or FakeTenant()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+        self.window = (0, 0)
+        self.thread = None
+        self.routes = [
+            # Stats are labelled with the path template, e.g. /api/apps/{app}
+            (
+                method,
+                re.compile(f"^{pattern}$"),
+                ID_LABEL.sub(r"{\1}", pattern),
+                handler,
+            )
+            for method, pattern, handler in ROUTES
+        ]
+
+    @property
+    def address(self) -> str:
+        return f"{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self) -> "FakeBritiveServer":
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def reset_stats(self) -> None:
+        with self.stats_lock:
+            self.stats = {}
+
+    def record(self, endpoint: str, status: int, seconds: float) -> None:
+        with self.stats_lock:
+            entry = self.stats.setdefault(
+                endpoint, {"latencies": [], "errors": 0, "throttled": 0}
+            )
+            entry["latencies"].append(seconds)
+            if status == 429:
+                entry["throttled"] += 1
+            elif status >= 400:
+                entry["errors"] += 1
+
+    def summary(self) -> dict:
+        # Per endpoint call counts and latency percentiles in milliseconds
+        with self.stats_lock:
+            stats = {
+                k: dict(v, latencies=list(v["latencies"]))
+                for k, v in self.stats.items()
+            }
+        everything = sorted(l for v in stats.values() for l in v["latencies"])
+        return {
+            "calls": len(everything),
+            "p50_ms": percentile(everything, 50),
+            "p99_ms": percentile(everything, 99),
+            "endpoints": {
+                endpoint: {
+                    "calls": len(v["latencies"]),
+                    "errors": v["errors"],
+                    "throttled": v["throttled"],
+                    "p50_ms": percentile(sorted(v["latencies"]), 50),
+                    "p99_ms": percentile(sorted(v["latencies"]), 99),
+                }
+                for endpoint, v in sorted(stats.items())
+            },
+        }
+
+    def throttled(self) -> bool:
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            return True
+        if not self.rate_limit:
+            return False
+        with self.stats_lock:
+            second, count = self.window
+            now = int(time.time())
+            if now != second:
+                second, count = now, 0
+            self.window = (second, count + 1)
+            return count >= self.rate_limit
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(
+        len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1)))
+    )
+    return round(sorted_values[index] * 1000, 3)
+
+
+def paginate(items: list, query: dict):
+    # Mirrors the inline pagination of the API when the caller asks for pages
+    if "page" not in query or "size" not in query:
+        return items
+    page, size = int(query["page"]), int(query["size"])
+    return {
+        "count": len(items),
+        "page": page,
+        "size": size,
+        "data": items[page * size : (page + 1) * size],
+    }
+
+
+class FakeBritiveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, avoid Nagle delays on keep-alive
+    disable_nagle_algorithm = True
+    server: FakeBritiveServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_PATCH(self):
+        self.dispatch("PATCH")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def do_HEAD(self):
+        self.dispatch("HEAD")
+
+    def dispatch(self, method: str):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            body = raw
+
+        server = self.server
+        endpoint, handler, params = f"{method} {url.path}", None, {}
+        for route_method, regex, pattern, route_handler in server.routes:
+            match = regex.match(url.path)
+            if route_method == method and match:
+                endpoint, handler, params = (
+                    f"{method} {pattern}",
+                    route_handler,
+                    match.groupdict(),
+                )
+                break
+
+        delay = server.latency_ms + random.uniform(0, server.jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+
+        if handler is None:
+            status, payload = 404, {
+                "errorCode": "E0404",
+                "message": f"no route {endpoint}",
+            }
+        elif server.throttled():
+            status, payload = 429, {
+                "errorCode": "E0429",
+                "message": "too many requests",
+            }
+        elif server.error_rate and random.random() < server.error_rate:
+            status, payload = server.error_status, {
+                "errorCode": "E0500",
+                "message": "injected error",
+            }
+        else:
+            try:
+                with server.tenant.lock:
+                    status, payload = handler(
+                        server, server.tenant, params, query, body
+                    )
+            except KeyError as e:
+                status, payload = 404, {
+                    "errorCode": "E0404",
+                    "message": f"not found: {e}",
+                }
+
+        content = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(content)
+        server.record(endpoint, status, time.perf_counter() - start)
+
+
+# Identity providers, users and tags
+
+
+def list_idps(server, t, p, q, body):
+    if "name" in q:
+        return 200, next(i for i in t.idps.values() if i["name"] == q["name"])
+    return 200, list(t.idps.values())
+
+
+def create_idp(server, t, p, q, body):
+    if any(i["name"] == body["name"] for i in t.idps.values()):
+        return 400, {"errorCode": "E1000", "message": "identity provider exists"}
+    return 200, t.add_idp(body["name"])
+
+
+def get_idp(server, t, p, q, body):
+    return 200, t.idps[p["idp"]]
+
+
+def update_idp(server, t, p, q, body):
+    t.idps[p["idp"]].update(body)
+    return 204, None
+
+
+def user_record(t, user: dict, include_tags: bool) -> dict:
+    idp = t.idps[user["identityProvider"]["id"]]
+    record = {
+        **user,
+        "identityProvider": {"id": idp["id"], "name": idp["name"]},
+    }
+    if include_tags:
+        record["userTags"] = [
+            {"userTagId": tag_id, "name": t.tags[tag_id]["name"]}
+            for tag_id in user["tags"]
+        ]
+    record.pop("tags")
+    return record
+
+
+def list_users(server, t, p, q, body):
+    include_tags = q.get("includeTags") == "true"
+    users = [user_record(t, u, include_tags) for u in t.users.values()]
+    return 200, paginate(users, q)
+
+
+def create_user(server, t, p, q, body):
+    if any(u["username"] == body["username"] for u in t.users.values()):
+        return 400, {"errorCode": "E1000", "message": "user exists"}
+    user = {
+        "userId": new_id(),
+        "username": body["username"],
+        "email": body["email"],
+        "firstName": body["firstName"],
+        "lastName": body["lastName"],
+        "status": body.get("status", "active"),
+        "identityProvider": {
+            "id": (body.get("identityProvider") or {}).get("id", BRITIVE_IDP_ID)
+        },
+        "tags": [],
+    }
+    t.users[user["userId"]] = user
+    return 200, user_record(t, user, False)
+
+
+def set_user_status(status):
+    def handler(server, t, p, q, body):
+        for user_id in body:
+            t.users[user_id]["status"] = status
+        return 200, [user_record(t, t.users[u], False) for u in body]
+
+    return handler
+
+
+def tag_record(t, tag: dict) -> dict:
+    idp = t.idps[tag["idp"]]
+    return {
+        "userTagId": tag["userTagId"],
+        "name": tag["name"],
+        "description": tag["description"],
+        "userTagIdentityProviders": [
+            {"identityProvider": {"id": idp["id"], "name": idp["name"]}}
+        ],
+    }
+
+
+def list_tags(server, t, p, q, body):
+    return 200, paginate([tag_record(t, tag) for tag in t.tags.values()], q)
+
+
+def create_tag(server, t, p, q, body):
+    if any(tag["name"] == body["name"] for tag in t.tags.values()):
+        return 400, {"errorCode": "E1000", "message": "tag exists"}
+    providers = body.get("userTagIdentityProviders") or []
+    tag = {
+        "userTagId": new_id(),
+        "name": body["name"],
+        "description": body.get("description"),
+        "idp": providers[0]["identityProvider"]["id"] if providers else BRITIVE_IDP_ID,
+    }
+    t.tags[tag["userTagId"]] = tag
+    return 200, tag_record(t, tag)
+
+
+def add_tag_user(server, t, p, q, body):
+    tags = t.users[p["user"]]["tags"]
+    if p["tag"] not in t.tags:
+        raise KeyError(p["tag"])
+    if p["tag"] not in tags:
+        tags.append(p["tag"])
+    return 200, {}
+
+
+def remove_tag_user(server, t, p, q, body):
+    tags = t.users[p["user"]]["tags"]
+    if p["tag"] in tags:
+        tags.remove(p["tag"])
+    return 204, None
+
+
+# Applications, environments, profiles and scans
+
+
+def list_catalog(server, t, p, q, body):
+    return 200, [
+        {"catalogAppId": i + 1, "name": name, "key": name}
+        for i, name in enumerate(CATALOG)
+    ]
+
+
+def list_apps(server, t, p, q, body):
+    return 200, list(t.apps.values())
+
+
+def create_app(server, t, p, q, body):
+    catalog_name = CATALOG[int(body["catalogAppId"]) - 1]
+    return 200, t.add_app(body["catalogAppDisplayName"], catalog_name)
+
+
+def get_app(server, t, p, q, body):
+    return 200, t.apps[p["app"]]
+
+
+def create_root_group(server, t, p, q, body):
+    return 200, {"id": "root"}
+
+
+def list_environments(server, t, p, q, body):
+    return 200, t.environments[p["app"]]
+
+
+def create_environment(server, t, p, q, body):
+    env = {
+        "environmentId": new_id(),
+        "name": body["name"],
+        "description": body.get("description"),
+    }
+    t.environments[p["app"]].append(env)
+    return 200, {"id": env["environmentId"], **env}
+
+
+def list_profiles(server, t, p, q, body):
+    return 200, paginate(t.profiles[p["app"]], q)
+
+
+def create_profile(server, t, p, q, body):
+    profile = {"papId": new_id(), "name": body["name"], "appContainerId": p["app"]}
+    t.profiles[p["app"]].append(profile)
+    return 200, profile
+
+
+def start_scan(server, t, p, q, body):
+    org_task, env_task = new_id(), new_id()
+    started = time.time()
+    t.scan_tasks[org_task] = {"app": p["app"], "started": started}
+    t.scan_tasks[env_task] = {"app": p["app"], "started": started, "org": org_task}
+    # groups seen by an earlier scan are reported as unchanged, or as updated when
+    # their members changed since, like the real scanner
+    for group in t.scan_groups.get(p["app"], {}).values():
+        members = hash(tuple(sorted(a["accountName"] for a in group["accounts"])))
+        scanned = group.pop("scanned", None)
+        if scanned is None:
+            group["scanStatus"] = "New"
+        else:
+            group["scanStatus"] = "Unchanged" if scanned == members else "Updated"
+        group["scanned"] = members
+    return 200, {"taskId": org_task, "status": "Running"}
+
+
+def scan_status(server, t, p, q, body):
+    task = t.scan_tasks[p["task"]]
+    done = time.time() - task["started"] >= t.scan_seconds
+    return 200, {"taskId": p["task"], "status": "Success" if done else "Running"}
+
+
+def scan_history(server, t, p, q, body):
+    history = [
+        {"taskId": task_id, "orgTaskId": task["org"], "status": "Success"}
+        for task_id, task in t.scan_tasks.items()
+        if task["app"] == p["app"] and "org" in task
+    ]
+    return 200, paginate(list(reversed(history)), q)
+
+
+def list_groups(server, t, p, q, body):
+    groups = [
+        {k: v for k, v in g.items() if k not in ("accounts", "scanned")}
+        for g in t.scan_groups.get(p["app"], {}).values()
+    ]
+    return 200, paginate(groups, q)
+
+
+def list_group_accounts(server, t, p, q, body):
+    return 200, paginate(t.scan_groups[p["app"]][p["group"]]["accounts"], q)
+
+
+def list_accounts(server, t, p, q, body):
+    return 200, paginate(t.scan_accounts.get(p["app"], []), q)
+
+
+# Notification mediums and access broker
+
+
+def list_notification_mediums(server, t, p, q, body):
+    return 200, {"result": list(t.notification_mediums.values())}
+
+
+def create_notification_medium(server, t, p, q, body):
+    medium = {"id": new_id(), "name": body["name"], "type": body["type"]}
+    t.notification_mediums[medium["id"]] = medium
+    return 200, medium
+
+
+def create_pool(server, t, p, q, body):
+    pool = {"pool-id": new_id(), "name": body["name"]}
+    t.pools[pool["pool-id"]] = pool
+    return 200, pool
+
+
+def list_resource_types(server, t, p, q, body):
+    return 200, {"data": list(t.resource_types.values())}
+
+
+def create_resource_type(server, t, p, q, body):
+    rt = {"resourceTypeId": new_id(), "name": body["name"]}
+    t.resource_types[rt["resourceTypeId"]] = rt
+    return 200, rt
+
+
+def create_permission(server, t, p, q, body):
+    perm = {"permissionId": new_id(), **body}
+    t.permissions[perm["permissionId"]] = perm
+    return 200, perm
+
+
+def permission_urls(server, t, p, q, body):
+    base = f"http://{server.address}/_upload/{p['perm']}"
+    return 200, {"checkinURL": f"{base}/checkin", "checkoutURL": f"{base}/checkout"}
+
+
+def update_permission(server, t, p, q, body):
+    t.permissions[p["perm"]].update(body)
+    return 200, t.permissions[p["perm"]]
+
+
+def upload(server, t, p, q, body):
+    return 200, None
+
+
+def list_permissions(server, t, p, q, body):
+    return 200, [
+        perm for perm in t.permissions.values() if perm["resourceTypeId"] == p["rt"]
+    ]
+
+
+def list_resources(server, t, p, q, body):
+    return 200, list(t.resources.values())
+
+
+def list_broker_profiles(server, t, p, q, body):
+    return 200, list(t.broker_profiles.values())
+
+
+def create_resource(server, t, p, q, body):
+    resource = {
+        "resourceId": new_id(),
+        "name": body["name"],
+        "resourceType": {"id": body["resourceType"]["id"]},
+    }
+    t.resources[resource["resourceId"]] = resource
+    return 200, resource
+
+
+def create_broker_profile(server, t, p, q, body):
+    profile = {"profileId": new_id(), "name": body["name"], "associations": []}
+    t.broker_profiles[profile["profileId"]] = profile
+    return 200, profile
+
+
+def add_association(server, t, p, q, body):
+    t.broker_profiles[p["profile"]]["associations"].append(body["associations"])
+    return 200, t.broker_profiles[p["profile"]]
+
+
+ID = "(?P<{}>[^/]+)"
+ID_LABEL = re.compile(r"\(\?P<(\w+)>\[\^/\]\+\)")
+APP = "/api/apps/" + ID.format("app")
+RM = "/api/resource-manager"
+ROUTES = [
+    ("GET", "/api/features", lambda *a: (200, [])),
+    ("HEAD", "/api/health", lambda *a: (200, None)),
+    ("GET", "/api/identity-providers", list_idps),
+    ("POST", "/api/identity-providers", create_idp),
+    ("GET", "/api/identity-providers/" + ID.format("idp"), get_idp),
+    ("PATCH", "/api/identity-providers/" + ID.format("idp"), update_idp),
+    ("GET", "/api/users", list_users),
+    ("POST", "/api/users", create_user),
+    ("POST", "/api/users/enabled-statuses", set_user_status("active")),
+    ("POST", "/api/users/disabled-statuses", set_user_status("inactive")),
+    ("GET", "/api/user-tags", list_tags),
+    ("POST", "/api/user-tags", create_tag),
+    (
+        "POST",
+        "/api/user-tags/{}/users/{}".format(ID.format("tag"), ID.format("user")),
+        add_tag_user,
+    ),
+    (
+        "DELETE",
+        "/api/user-tags/{}/users/{}".format(ID.format("tag"), ID.format("user")),
+        remove_tag_user,
+    ),
+    ("GET", "/api/system/apps", list_catalog),
+    ("GET", "/api/apps", list_apps),
+    ("POST", "/api/apps", create_app),
+    ("GET", "/api/apps/tasks/" + ID.format("task") + "/status", scan_status),
+    ("GET", APP, get_app),
+    ("POST", APP + "/root-environment-group/groups", create_root_group),
+    ("POST", APP + "/root-environment-group/environments", create_environment),
+    ("GET", APP + "/environments", list_environments),
+    ("GET", APP + "/paps", list_profiles),
+    ("POST", APP + "/paps", create_profile),
+    ("POST", APP + "/scan", start_scan),
+    ("GET", APP + "/scans/env-status/history", scan_history),
+    ("GET", APP + "/environments/" + ID.format("env") + "/groups", list_groups),
+    (
+        "GET",
+        APP
+        + "/environments/{}/groups/{}/accounts".format(
+            ID.format("env"), ID.format("group")
+        ),
+        list_group_accounts,
+    ),
+    ("GET", APP + "/environments/" + ID.format("env") + "/accounts", list_accounts),
+    (
+        "GET",
+        "/api/v1/notification-service/notificationmediums",
+        list_notification_mediums,
+    ),
+    (
+        "POST",
+        "/api/v1/notification-service/notificationmediums",
+        create_notification_medium,
+    ),
+    ("POST", RM + "/remote-broker/pools", create_pool),
+    ("GET", RM + "/resource-types", list_resource_types),
+    ("POST", RM + "/resource-types", create_resource_type),
+    (
+        "GET",
+        RM + "/resource-types/" + ID.format("rt") + "/permissions",
+        list_permissions,
+    ),
+    ("POST", RM + "/permissions", create_permission),
+    ("GET", RM + "/permissions/get-urls/" + ID.format("perm"), permission_urls),
+    ("PUT", RM + "/permissions/" + ID.format("perm"), update_permission),
+    ("PUT", "/_upload/" + ID.format("perm") + "/" + ID.format("kind"), upload),
+    ("GET", RM + "/resources", list_resources),
+    ("POST", RM + "/resources", create_resource),
+    ("GET", RM + "/profiles", list_broker_profiles),
+    ("POST", RM + "/profiles", create_broker_profile),
+    (
+        "POST",
+        RM + "/profiles/" + ID.format("profile") + "/associations",
+        add_association,
+    ),
+]
+
+
+class PlainHttpAdapter(HTTPAdapter):
+    # The SDK always builds https:// urls, the fake server only speaks http
+    def send(self, request, **kwargs):
+        request.url = "http://" + request.url[len("https://") :]
+        return super().send(request, **kwargs)
+
+
+def point_sdk_at(address: str) -> None:
+    """Send every request of Britive clients created after this call to address."""
+    import britive.britive as sdk
+
+    sdk.parse_tenant = lambda tenant, timeout=3: address
+    setup_session = sdk.Britive._setup_session
+
+    def _setup_session(self):
+        session = setup_session(self)
+        session.mount(f"https://{address}", PlainHttpAdapter())
+        return session
+
+    sdk.Britive._setup_session = _setup_session
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Britive API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="Added to every call"
+    )
+    parser.add_argument(
+        "--jitter-ms", type=float, default=0, help="Random extra latency"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="Share of calls that fail"
+    )
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0,
+        help="Share of calls answered with 429",
+    )
+    parser.add_argument(
+        "--rate-limit", type=int, default=0, help="Calls per second before 429"
+    )
+    parser.add_argument(
+        "--scim-users",
+        type=int,
+        default=0,
+        help="Seed a scanned app with this many users",
+    )
+    parser.add_argument("--scim-groups", type=int, default=10)
+    parser.add_argument("--scim-app-id", default="scim-app")
+    parser.add_argument("--scim-idp-id", default="scim-idp")
+    args = parser.parse_args()
+
+    server = FakeBritiveServer(
+        address=(args.host, args.port),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        throttle_rate=args.throttle_rate,
+        rate_limit=args.rate_limit,
+    )
+    if args.scim_users:
+        server.tenant.seed_scim_app(
+            app_id=args.scim_app_id,
+            idp_id=args.scim_idp_id,
+            users=args.scim_users,
+            groups=args.scim_groups,
+        )
+    print(f"fake Britive API listening on http://{server.address}/api")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@ import argparse
 import os
 import secrets
 import string
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
 from dotenv import load_dotenv
 
@@ -14,6 +17,11 @@ except ImportError:
 import jmespath
 from colorama import Fore, Style
 
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
 from britive.britive import Britive
 
 """
@@ -43,22 +51,53 @@ if not BRITIVE_TENANT or not BRITIVE_API_TOKEN:
     )
     exit(1)
 
-# Load JSON data file
+# Default worker pool size for bulk operations
+DEFAULT_CONCURRENCY = 8
+
+# Name -> id indexes of objects that already exist in the tenant.
+# Only populated in --plan/--apply mode, otherwise every object is created.
+existing = {}
+
+# Default input data file
 DATA_FILE_INPUT = "britive/data_input.json"
+data = {}
 
-try:
-    with open(DATA_FILE_INPUT, "r") as file:
-        data = json.load(file)
-except FileNotFoundError:
-    print(
-        f"{caution}Data file '{DATA_FILE_INPUT}' not found. Ensure it exists.{Style.RESET_ALL}"
-    )
-    exit(1)
-except json.JSONDecodeError:
-    print(
-        f"{caution}Error decoding JSON in file '{DATA_FILE_INPUT}'. Check for syntax errors.{Style.RESET_ALL}"
-    )
-    exit(1)
+# Created objects are journaled next to the input file, <input>.journal.jsonl
+JOURNAL_SUFFIX = ".journal.jsonl"
+
+# JSON Lines and YAML input is read as a stream of records, one object family at a time.
+# A JSONL line, or a YAML document, is either one record with a "family" key naming
+# its family (users, tags, apps, ...) or a mapping of families to lists of records.
+STREAM_FORMATS = (".jsonl", ".yaml", ".yml")
+FAMILY_KEY = "family"
+STREAM_BATCH_SIZE = 1000
+
+# The data family each step reads its records from
+STEP_FAMILIES = {
+    "idps": "idps",
+    "users": "users",
+    "tags": "tags",
+    "applications": "apps",
+    "profiles": "apps",
+    "notification": "notification",
+    "resourceTypes": "resourcesTypes",
+}
+
+# Append-only journal of every object created during a run, one JSON line per create.
+# Each entry holds the path of the object in the data file, e.g. ["apps", "AWS"],
+# and the fields (like "id") returned by the API.
+journal = {}
+journal_file = None
+journal_lock = threading.Lock()
+
+# Tenant metadata cache: name -> id indexes of the reference data every step looks
+# up (application catalog, IdPs, tags and applications). Each family is listed once
+# and kept on disk for the cache TTL, so later runs do not list it again.
+CACHE_FILE = "britive/.tenant_cache.json"
+DEFAULT_CACHE_TTL = 3600
+tenant_cache = {}
+cache_ttl = DEFAULT_CACHE_TTL
+cache_lock = threading.Lock()
 
 try:
     br = Britive(tenant=BRITIVE_TENANT, token=BRITIVE_API_TOKEN)
@@ -67,17 +106,8 @@ except Exception as e:
     print(f"{caution}Failed to initialize Britive API: {e}{Style.RESET_ALL}")
     exit(1)
 
-# Get the id for the local (Britive) Identity Provider
-try:
-    idp_list = br.identity_management.identity_providers.list()
-    britive_idp = next(
-        (item["id"] for item in idp_list if item["name"] == "Britive"), None
-    )
-    if not britive_idp:
-        raise ValueError("Britive Identity Provider ID not found.")
-except Exception as e:
-    print(f"{caution}Error retrieving Britive IDP: {e}{Style.RESET_ALL}")
-    exit(1)
+# Id of the local (Britive) Identity Provider, resolved from the tenant cache in main()
+britive_idp = None
 
 
 def main():
@@ -117,49 +147,652 @@ def main():
         action="store_true",
         help="Process creation of a single broker pool",
     )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=DATA_FILE_INPUT,
+        help=f"Input data file: .json, .jsonl or .yaml (default {DATA_FILE_INPUT})",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Create users concurrently, resolving each IdP once",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Maximum number of concurrent API calls in bulk mode and for resource types (default {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Run independent object families concurrently, respecting dependencies",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Replay the journal and skip objects created by an interrupted run",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=DEFAULT_CACHE_TTL,
+        help=f"Seconds to reuse the tenant metadata cache (default {DEFAULT_CACHE_TTL}, 0 disables it)",
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        nargs="*",
+        metavar="FAMILY",
+        help="Discard the cached catalog, idps, tags and/or apps (all when none given)",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Show which objects are missing from the tenant without creating anything",
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Only create objects that are missing from the tenant",
+    )
 
     args = parser.parse_args()
 
+    open_cache(ttl=args.cache_ttl)
+    if args.refresh_cache is not None:
+        for family in args.refresh_cache or [None]:
+            invalidate_cache(family)
+
+    # Get the id for the local (Britive) Identity Provider
+    global britive_idp
+    try:
+        britive_idp = tenant_index("idps").get("Britive")
+        if not britive_idp:
+            raise ValueError("Britive Identity Provider ID not found.")
+    except Exception as e:
+        print(f"{caution}Error retrieving Britive IDP: {e}{Style.RESET_ALL}")
+        exit(1)
+
+    global data
+    streaming = args.file.lower().endswith(STREAM_FORMATS)
+    if streaming and not os.path.exists(args.file):
+        print(
+            f"{caution}Data file '{args.file}' not found. Ensure it exists.{Style.RESET_ALL}"
+        )
+        exit(1)
+    if not streaming:
+        try:
+            with open(args.file, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            print(
+                f"{caution}Data file '{args.file}' not found. Ensure it exists.{Style.RESET_ALL}"
+            )
+            exit(1)
+        except json.JSONDecodeError:
+            print(
+                f"{caution}Error decoding JSON in file '{args.file}'. Check for syntax errors.{Style.RESET_ALL}"
+            )
+            exit(1)
+
+    if args.plan or args.apply:
+        try:
+            load_existing(args)
+        except Exception as e:
+            print(f"{caution}Failed to list existing objects: {e}{Style.RESET_ALL}")
+            exit(1)
+
+    if args.plan:
+        if streaming:
+            total = 0
+            for family, batch in iter_batches(args.file):
+                data = {family: batch}
+                total += print_plan(args)
+        else:
+            total = print_plan(args)
+        print(f"{info}Plan: {total} objects to create.{Style.RESET_ALL}")
+        return
+
+    journal_path = os.path.splitext(args.file)[0] + JOURNAL_SUFFIX
+    try:
+        open_journal(journal_path, resume=args.resume)
+    except Exception as e:
+        print(f"{caution}Failed to open journal '{journal_path}': {e}{Style.RESET_ALL}")
+        exit(1)
+
+    # Each step lists the steps it depends on (e.g. users need their IdPs)
+    workers = args.concurrency if args.parallel else 1
+    steps = {
+        name: (func, deps)
+        for name, selected, func, deps in [
+            ("idps", args.idps, process_idps, []),
+            (
+                "users",
+                args.users,
+                (
+                    (lambda: process_users_bulk(max_workers=args.concurrency))
+                    if args.bulk
+                    else process_users
+                ),
+                ["idps"],
+            ),
+            ("tags", args.tags, process_tags, []),
+            ("applications", args.applications, process_applications, []),
+            (
+                "profiles",
+                args.profiles,
+                lambda: process_profiles(max_workers=workers),
+                ["applications"],
+            ),
+            ("notification", args.notification, process_notification, []),
+            ("brokerPool", args.brokerPool, process_broker_pool, []),
+            (
+                "resourceTypes",
+                args.resourceTypes,
+                lambda: process_resource_types(max_workers=args.concurrency),
+                [],
+            ),
+        ]
+        if selected
+    }
+
+    def run(selected_steps):
+        if args.parallel:
+            run_steps(selected_steps, max_workers=workers)
+        else:
+            for func, _ in selected_steps.values():
+                func()
+
+    failed = False
     try:
-        if args.idps:
-            process_idps()
-        if args.users:
-            process_users()
-        if args.tags:
-            process_tags()
-        if args.applications:
-            process_applications()
-        if args.profiles:
-            process_profiles()
-        if args.notification:
-            process_notification()
-        if args.brokerPool:
-            process_broker_pool()
-        if args.resourceTypes:
-            process_resource_types()
+        if streaming:
+            process_stream(args.file, steps, run)
+        else:
+            run(steps)
+    except ResourceTypeErrors as e:
+        # The ids of the items that were created and the errors of the others are
+        # still saved to the data file
+        print(f"{caution}{e}{Style.RESET_ALL}")
+        failed = True
     except Exception as e:
         print(f"{caution}An error occurred while processing: {e}{Style.RESET_ALL}")
+        save_cache()
         exit(1)
 
+    save_cache()
+    if streaming:
+        return
+
     # Save updated data back to JSON
     try:
-        with open(DATA_FILE_INPUT, "w") as f:
+        with open(args.file, "w") as f:
             json.dump(data, f)
     except Exception as e:
+        print(f"{caution}Failed to save updates to '{args.file}': {e}{Style.RESET_ALL}")
+    if failed:
+        exit(1)
+
+
+def iter_records(path):
+    # Yield (family, record) pairs without loading the whole file
+    if path.lower().endswith(".jsonl"):
+        with open(path, "r") as f:
+            documents = (json.loads(line) for line in f if line.strip())
+            yield from iter_document_records(documents)
+    else:
+        if yaml is None:
+            raise RuntimeError("PyYAML is required to read YAML input files")
+        with open(path, "r") as f:
+            yield from iter_document_records(yaml.safe_load_all(f))
+
+
+def iter_document_records(documents):
+    for document in documents:
+        if not document:
+            continue
+        if FAMILY_KEY in document:
+            yield document.pop(FAMILY_KEY), document
+            continue
+        for family, records in document.items():
+            for record in records or []:
+                yield family, record
+
+
+def iter_batches(path, size=STREAM_BATCH_SIZE):
+    # Group consecutive records of the same family into batches of at most size records
+    family, batch = None, []
+    for record_family, record in iter_records(path):
+        if batch and (record_family != family or len(batch) >= size):
+            yield family, batch
+            batch = []
+        family = record_family
+        batch.append(record)
+    if batch:
+        yield family, batch
+
+
+def process_stream(path, steps, run):
+    # Run the steps of each family on one batch at a time and write every
+    # processed record straight away, so memory use does not grow with the input
+    global data
+    output_path = os.path.splitext(path)[0] + ".out.jsonl"
+    print(f"{info}Streaming '{path}' into '{output_path}'{Style.RESET_ALL}")
+    errors = []
+    with open(output_path, "w") as out:
+        for family, batch in iter_batches(path):
+            data = {family: batch}
+            restore_journal()
+            try:
+                run(
+                    {
+                        name: step
+                        for name, step in steps.items()
+                        if STEP_FAMILIES.get(name) == family
+                    }
+                )
+            except ResourceTypeErrors as e:
+                # The batch is still written, with the error of each failed item
+                errors += e.errors
+            for record in batch:
+                out.write(json.dumps({FAMILY_KEY: family, **record}) + "\n")
+            out.flush()
+
+    # Steps that do not read from the input, like the broker pool, run once
+    run({name: step for name, step in steps.items() if name not in STEP_FAMILIES})
+    if errors:
+        raise ResourceTypeErrors(errors)
+
+
+def run_steps(steps, max_workers=DEFAULT_CONCURRENCY):
+    # Start every step as soon as the selected steps it depends on have finished
+    pending = dict(steps)
+    done = set()
+    running = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name, (func, deps) in list(pending.items()):
+                if all(dep in done or dep not in steps for dep in deps):
+                    running[executor.submit(func)] = name
+                    del pending[name]
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except ResourceTypeErrors as e:
+                    # The failed items are reported, the other steps carry on
+                    errors += e.errors
+                    done.add(name)
+                    print(f"{caution}Finished {name} with {e}{Style.RESET_ALL}")
+                    continue
+                except Exception as e:
+                    # Do not start anything else, let the running steps finish
+                    pending.clear()
+                    raise RuntimeError(f"step {name} failed: {e}") from e
+                done.add(name)
+                print(f"{green}Finished {name}{Style.RESET_ALL}")
+    if errors:
+        raise ResourceTypeErrors(errors)
+
+
+def restore_journal(node=None, prefix=()):
+    # Copy the fields of already created objects into the current data, walking the
+    # data once and looking each object up by its journal path
+    for family, items in (data if node is None else node).items():
+        if not isinstance(items, list):
+            continue
+        key = "username" if family == "users" else "name"
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            path = prefix + (family, item.get(key))
+            if path in journal:
+                item.update(journal[path])
+            restore_journal(item, path)
+
+
+def open_journal(path, resume=False):
+    global journal_file
+    if resume:
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line may be torn if the process was killed mid-write
+                        continue
+                    journal.setdefault(tuple(entry.pop("path")), {}).update(entry)
+        except FileNotFoundError:
+            print(f"{warn}No journal found at '{path}'.{Style.RESET_ALL}")
+        restore_journal()
+        print(
+            f"{info}Resuming: {len(journal)} objects already created.{Style.RESET_ALL}"
+        )
+    elif os.path.exists(path) and os.path.getsize(path) > 0:
+        # The journal of an earlier run, which may have crashed, is kept for --resume
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(os.path.getmtime(path)))
+        rotated = path[: -len(JOURNAL_SUFFIX)] + f".{stamp}" + JOURNAL_SUFFIX
+        os.replace(path, rotated)
         print(
-            f"{caution}Failed to save updates to '{DATA_FILE_INPUT}': {e}{Style.RESET_ALL}"
+            f"{warn}Moved the journal of the previous run to '{rotated}'. "
+            f"Move it back and use --resume to continue that run.{Style.RESET_ALL}"
         )
+    journal_file = open(path, "a" if resume else "w")
+    if journal_file.tell() > 0:
+        # Start on a fresh line in case the last entry was torn
+        journal_file.write("\n")
+
+
+def journal_record(path, **fields):
+    # Persist a created object before moving on, so a crash cannot lose its id
+    line = json.dumps({"path": list(path), **fields})
+    with journal_lock:
+        journal.setdefault(tuple(path), {}).update(fields)
+        if journal_file:
+            journal_file.write(line + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+
+def is_done(path):
+    return tuple(path) in journal
+
+
+def index_by_name(items, name_key, id_key):
+    return {item[name_key]: item[id_key] for item in items}
+
+
+CACHE_LOADERS = {
+    "catalog": lambda: index_by_name(
+        br.application_management.applications.catalog(), "name", "catalogAppId"
+    ),
+    "idps": lambda: index_by_name(
+        br.identity_management.identity_providers.list(), "name", "id"
+    ),
+    "tags": lambda: index_by_name(
+        br.identity_management.tags.list(), "name", "userTagId"
+    ),
+    "apps": lambda: index_by_name(
+        br.application_management.applications.list(),
+        "catalogAppDisplayName",
+        "appContainerId",
+    ),
+}
+
+
+def open_cache(ttl=DEFAULT_CACHE_TTL):
+    global cache_ttl
+    cache_ttl = ttl
+    if ttl <= 0:
+        return
+    try:
+        with open(CACHE_FILE, "r") as f:
+            cached = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    if cached.get("tenant") == BRITIVE_TENANT:
+        tenant_cache.update(cached.get("families", {}))
+
+
+def save_cache():
+    if cache_ttl <= 0:
+        return
+    with cache_lock:
+        content = {"tenant": BRITIVE_TENANT, "families": tenant_cache}
+        try:
+            # Write to a temporary file first so a crash never leaves a torn cache
+            with open(CACHE_FILE + ".tmp", "w") as f:
+                json.dump(content, f)
+            os.replace(CACHE_FILE + ".tmp", CACHE_FILE)
+        except Exception as e:
+            print(f"{warn}Failed to save tenant cache: {e}{Style.RESET_ALL}")
+
+
+def tenant_index(family):
+    # Name -> id index of a cached family, listed from the tenant when missing or expired.
+    # A TTL of 0 only disables the cache file, the index is still shared within the run.
+    with cache_lock:
+        entry = tenant_cache.get(family)
+        if entry is None or 0 < cache_ttl < time.time() - entry["fetched_at"]:
+            entry = {"fetched_at": time.time(), "index": CACHE_LOADERS[family]()}
+            tenant_cache[family] = entry
+        return entry["index"]
+
+
+def cache_add(family, name, item_id):
+    # Keep a cached index in step with the objects created during the run
+    with cache_lock:
+        if family in tenant_cache:
+            tenant_cache[family]["index"][name] = item_id
+
+
+def invalidate_cache(family=None):
+    with cache_lock:
+        if family:
+            tenant_cache.pop(family, None)
+        else:
+            tenant_cache.clear()
+
+
+def fresh_index(family):
+    # Plan and apply decide what to create from these listings, so objects deleted or
+    # renamed since the cache file was written must not be trusted
+    invalidate_cache(family)
+    return tenant_index(family)
+
+
+def load_existing(args):
+    # List each selected object family once and index it by name
+    loaders = {
+        "idps": (args.idps or args.users, lambda: fresh_index("idps")),
+        "users": (
+            args.users,
+            lambda: index_by_name(
+                br.identity_management.users.list(), "username", "userId"
+            ),
+        ),
+        "tags": (args.tags, lambda: fresh_index("tags")),
+        "apps": (args.applications or args.profiles, lambda: fresh_index("apps")),
+        "notification": (
+            args.notification,
+            lambda: index_by_name(
+                br.global_settings.notification_mediums.list(), "name", "id"
+            ),
+        ),
+        "resourcesTypes": (
+            args.resourceTypes,
+            lambda: index_by_name(
+                br.access_broker.resources.types.list(), "name", "resourceTypeId"
+            ),
+        ),
+    }
+    for family, (selected, loader) in loaders.items():
+        if selected:
+            existing[family] = loader()
+            print(
+                f"{info}Found {len(existing[family])} existing {family}{Style.RESET_ALL}"
+            )
+
+
+def existing_app_children(app_id):
+    # Environments and profiles are listed per application, once per run
+    key = ("app", app_id)
+    if key not in existing:
+        existing[key] = {
+            "envs": index_by_name(
+                br.application_management.environments.list(application_id=app_id),
+                "name",
+                "environmentId",
+            ),
+            "profiles": index_by_name(
+                br.application_management.profiles.list(application_id=app_id),
+                "name",
+                "papId",
+            ),
+        }
+    return existing[key]
+
+
+def profile_resource_types(profile):
+    # A broker profile belongs to the resource types named by its associations
+    associations = profile.get("associations") or []
+    if isinstance(associations, dict):
+        associations = [associations]
+    rt_ids = existing.get("resourcesTypes", {})
+    return [
+        rt_ids[a["Resource-Type"]]
+        for a in associations
+        if a.get("Resource-Type") in rt_ids
+    ]
+
+
+def existing_resource_type_children(rt_id=None):
+    # Resources and broker profiles are listed once for all types and indexed by
+    # (resource type id, name), because the same names are used under several types.
+    # Permissions are listed per resource type, once per run
+    if "resources" not in existing:
+        existing["resources"] = {
+            (resource["resourceType"]["id"], resource["name"]): resource["resourceId"]
+            for resource in br.access_broker.resources.list()
+        }
+        existing["brokerProfiles"] = {
+            (profile_rt_id, profile["name"]): profile["profileId"]
+            for profile in br.access_broker.profiles.list()
+            for profile_rt_id in profile_resource_types(profile)
+        }
+    key = ("resourcesTypes", rt_id)
+    if key not in existing:
+        if rt_id:
+            existing[key] = {
+                "permissions": index_by_name(
+                    br.access_broker.resources.permissions.list(resource_type_id=rt_id),
+                    "name",
+                    "permissionId",
+                ),
+                "resources": {
+                    name: child_id
+                    for (child_rt_id, name), child_id in existing["resources"].items()
+                    if child_rt_id == rt_id
+                },
+                "profiles": {
+                    name: child_id
+                    for (child_rt_id, name), child_id in existing[
+                        "brokerProfiles"
+                    ].items()
+                    if child_rt_id == rt_id
+                },
+            }
+        else:
+            # A resource type that is not in the tenant has no children yet
+            existing[key] = {"permissions": {}, "resources": {}, "profiles": {}}
+    return existing[key]
+
+
+def find_existing(family, name):
+    return existing.get(family, {}).get(name)
+
+
+def skip_existing(family, item, name_key="name"):
+    # Record the id of an object that is already in the tenant instead of creating it
+    item_id = find_existing(family, item[name_key])
+    if item_id is None:
+        return False
+    item["id"] = item_id
+    print(f"{info}{item[name_key]} already exists - skipping{Style.RESET_ALL}")
+    return True
+
+
+def print_plan(args):
+    families = [
+        ("idps", args.idps, "name"),
+        ("users", args.users, "username"),
+        ("tags", args.tags, "name"),
+        ("apps", args.applications, "name"),
+        ("notification", args.notification, "name"),
+        ("resourcesTypes", args.resourceTypes, "name"),
+    ]
+    total = 0
+    for family, selected, name_key in families:
+        if not selected or family not in data:
+            continue
+        items = jmespath.search(family, data) or []
+        missing = [
+            i[name_key] for i in items if find_existing(family, i[name_key]) is None
+        ]
+        total += len(missing)
+        print(
+            f"{green}{family}: {len(missing)} to create, "
+            f"{len(items) - len(missing)} already exist{Style.RESET_ALL}"
+        )
+        for name in missing:
+            print(f"  + {name}")
+
+    if args.profiles:
+        for app in data.get("apps") or []:
+            app_id = app.get("id") or find_existing("apps", app["name"])
+            children = (
+                existing_app_children(app_id)
+                if app_id
+                else {"envs": {}, "profiles": {}}
+            )
+            for kind in ("envs", "profiles"):
+                missing = [
+                    i["name"]
+                    for i in app.get(kind, [])
+                    if i["name"] not in children[kind]
+                ]
+                total += len(missing)
+                print(
+                    f"{green}{app['name']} {kind}: {len(missing)} to create{Style.RESET_ALL}"
+                )
+                for name in missing:
+                    print(f"  + {name}")
+
+    if args.resourceTypes:
+        for rt in data.get("resourcesTypes") or []:
+            children = existing_resource_type_children(
+                find_existing("resourcesTypes", rt["name"])
+            )
+            for kind in ("permissions", "resources", "profiles"):
+                missing = [
+                    i["name"]
+                    for i in rt.get(kind) or []
+                    if i["name"] not in children[kind]
+                ]
+                total += len(missing)
+                print(
+                    f"{green}{rt['name']} {kind}: {len(missing)} to create{Style.RESET_ALL}"
+                )
+                for name in missing:
+                    print(f"  + {name}")
+
+    return total
 
 
 def process_tags():
     tags = jmespath.search("tags", data)
     print(f"{info}Processing {len(tags)} Tags...{Style.RESET_ALL}")
     for tag in tags:
+        if skip_existing("tags", tag) or is_done(("tags", tag["name"])):
+            continue
         print(f"{tag['name']}")
         tag_response = br.identity_management.tags.create(
             name=tag["name"], description=tag["description"], idp=britive_idp
         )
         tag["id"] = tag_response["userTagId"]
+        cache_add("tags", tag["name"], tag["id"])
+        journal_record(("tags", tag["name"]), id=tag["id"])
+
+
+def generate_password(length=12):
+    return "".join(
+        secrets.choice(string.ascii_letters + string.digits + string.punctuation)
+        for _ in range(length)
+    )
 
 
 def process_users():
@@ -175,12 +808,15 @@ def process_users():
 
     for user in users:
         try:
+            if skip_existing("users", user, name_key="username") or is_done(
+                ("users", user["username"])
+            ):
+                continue
             print(f"{user['email']} on {user['idp']}")
             try:
-                idp_response = br.identity_management.identity_providers.get_by_name(
-                    identity_provider_name=user["idp"]
-                )
-                user_idp = idp_response["id"]
+                user_idp = tenant_index("idps").get(user["idp"])
+                if not user_idp:
+                    raise ValueError(f"Identity provider {user['idp']} not found")
                 print(f"{info}User IdP {user['idp']} : {user_idp}{Style.RESET_ALL}")
             except Exception as e:
                 print(
@@ -189,12 +825,7 @@ def process_users():
                 continue
 
             try:
-                random_string = "".join(
-                    secrets.choice(
-                        string.ascii_letters + string.digits + string.punctuation
-                    )
-                    for _ in range(12)
-                )
+                random_string = generate_password()
                 print(f"{warn}{random_string}{Style.RESET_ALL}")
             except Exception as e:
                 print(
@@ -213,6 +844,7 @@ def process_users():
                     password=random_string,
                 )
                 user["id"] = user_response["userId"]
+                journal_record(("users", user["username"]), id=user["id"])
             except Exception as e:
                 print(
                     f"{caution}Failed to create user {user['email']}: {e}{Style.RESET_ALL}"
@@ -227,45 +859,159 @@ def process_users():
             )
 
 
-def process_applications():
-    app_catalog = jmespath.search(
-        "[].{name: name, id: catalogAppId}",
-        br.application_management.applications.catalog(),
+def create_user(user, user_idp):
+    password = generate_password()
+    user_response = br.identity_management.users.create(
+        idp=user_idp,
+        email=user["email"],
+        firstName=user["firstname"],
+        lastName=user["lastname"],
+        username=user["username"],
+        status="active",
+        password=password,
+    )
+    journal_record(("users", user["username"]), id=user_response["userId"])
+    return user_response["userId"], password
+
+
+def process_users_bulk(max_workers=DEFAULT_CONCURRENCY):
+    users = jmespath.search("users", data)
+    if not users:
+        print(f"{caution}No users found in the input data.{Style.RESET_ALL}")
+        return
+    print(
+        f"{info}Processing {len(users)} users with {max_workers} workers...{Style.RESET_ALL}"
+    )
+
+    # Group users by IdP so every IdP is resolved exactly once
+    users_by_idp = {}
+    skipped = 0
+    for user in users:
+        existing_id = find_existing("users", user.get("username"))
+        if existing_id is not None:
+            user["id"] = existing_id
+            skipped += 1
+            continue
+        if is_done(("users", user.get("username"))):
+            skipped += 1
+            continue
+        users_by_idp.setdefault(user.get("idp"), []).append(user)
+
+    idp_ids = {}
+    for idp_name, idp_users in users_by_idp.items():
+        try:
+            idp_id = tenant_index("idps").get(idp_name)
+            if not idp_id:
+                raise ValueError(f"Identity provider {idp_name} not found")
+            idp_ids[idp_name] = idp_id
+            print(f"{info}User IdP {idp_name} : {idp_ids[idp_name]}{Style.RESET_ALL}")
+        except Exception as e:
+            print(f"{caution}Error fetching IdP {idp_name}: {e}{Style.RESET_ALL}")
+            for user in idp_users:
+                user["error"] = f"IdP {idp_name} not found: {e}"
+
+    created = failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(create_user, user, idp_ids[idp_name]): user
+            for idp_name, idp_users in users_by_idp.items()
+            if idp_name in idp_ids
+            for user in idp_users
+        }
+        for future in as_completed(futures):
+            user = futures[future]
+            try:
+                user["id"], password = future.result()
+                user.pop("error", None)
+                created += 1
+                # The generated password is only shown here, like in process_users
+                print(f"{warn}{user['email']}: {password}{Style.RESET_ALL}")
+            except KeyError as e:
+                user["error"] = f"Missing required user field: {e}"
+                failed += 1
+            except Exception as e:
+                user["error"] = str(e)
+                failed += 1
+
+    failed += sum(
+        len(idp_users)
+        for idp_name, idp_users in users_by_idp.items()
+        if idp_name not in idp_ids
+    )
+    print(
+        f"{green}Created {created} users, {skipped} already existed, {failed} failed. "
+        f"Failures are recorded in the 'error' field of each user.{Style.RESET_ALL}"
     )
+
+
+def process_applications():
+    app_catalog = tenant_index("catalog")
     apps = jmespath.search(expression="apps", data=data)
     print(f"{info}Processing {len(apps)} applications...{Style.RESET_ALL}")
     for app in apps:
-        catalog_id = [
-            item["id"] for item in app_catalog if item["name"] == app["type"]
-        ][0]
+        if skip_existing("apps", app) or is_done(("apps", app["name"])):
+            continue
+        catalog_id = app_catalog[app["type"]]
         app_response = br.application_management.applications.create(
             application_name=app["name"], catalog_id=catalog_id
         )
         app["id"] = app_response["appContainerId"]
+        cache_add("apps", app["name"], app["id"])
+        journal_record(("apps", app["name"]), id=app["id"])
 
 
-def process_profiles():
+def process_profiles(max_workers=1):
     apps = jmespath.search(expression="apps", data=data)
-    for app in apps:
-        envs = app["envs"]
-        print(f"{info}Processing Environments for app: {app['name']} {Style.RESET_ALL}")
-        for env in envs:
-            br.application_management.environments.create(
-                application_id=app["id"],
-                name=env["name"],
-                description=env["description"],
-            )
+    if max_workers > 1:
+        # Applications are independent of each other, so fan out per app
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for future in as_completed(
+                [executor.submit(process_app_profiles, app) for app in apps]
+            ):
+                future.result()
+    else:
+        for app in apps:
+            process_app_profiles(app)
 
-        # Process Profiles after environments are created
-        profiles = app["profiles"]
-        print(f"{info}Processing profiles for app: {app['name']} {Style.RESET_ALL}")
-        for profile in profiles:
-            br.application_management.profiles.create(
-                application_id=app["id"],
-                name=profile["name"],
-                status="active",
-                expirationDuration=profile["Expiration"],
-            )
+
+def process_app_profiles(app):
+    if "id" not in app and find_existing("apps", app["name"]):
+        app["id"] = find_existing("apps", app["name"])
+    children = (
+        existing_app_children(app["id"]) if existing else {"envs": {}, "profiles": {}}
+    )
+
+    envs = app["envs"]
+    print(f"{info}Processing Environments for app: {app['name']} {Style.RESET_ALL}")
+    for env in envs:
+        if env["name"] in children["envs"]:
+            print(f"{info}{env['name']} already exists - skipping{Style.RESET_ALL}")
+            continue
+        if is_done(("apps", app["name"], "envs", env["name"])):
+            continue
+        br.application_management.environments.create(
+            application_id=app["id"],
+            name=env["name"],
+            description=env["description"],
+        )
+        journal_record(("apps", app["name"], "envs", env["name"]))
+
+    # Process Profiles after environments are created
+    profiles = app["profiles"]
+    print(f"{info}Processing profiles for app: {app['name']} {Style.RESET_ALL}")
+    for profile in profiles:
+        if profile["name"] in children["profiles"]:
+            print(f"{info}{profile['name']} already exists - skipping{Style.RESET_ALL}")
+            continue
+        if is_done(("apps", app["name"], "profiles", profile["name"])):
+            continue
+        br.application_management.profiles.create(
+            application_id=app["id"],
+            name=profile["name"],
+            status="active",
+            expirationDuration=profile["Expiration"],
+        )
+        journal_record(("apps", app["name"], "profiles", profile["name"]))
 
 
 def process_notification():
@@ -274,6 +1020,10 @@ def process_notification():
         f"{green}Processing {len(notifications)} Notification Mediums...{Style.RESET_ALL}"
     )
     for note in notifications:
+        if skip_existing("notification", note) or is_done(
+            ("notification", note["name"])
+        ):
+            continue
         print(note["name"])
         br.global_settings.notification_mediums.create(
             name=note["name"],
@@ -281,17 +1031,22 @@ def process_notification():
             notification_medium_type=note["type"],
             url=note["url"],
         )
+        journal_record(("notification", note["name"]))
 
 
 def process_idps():
     idps = jmespath.search(expression="idps", data=data)
     print(f"{green}Processing {len(idps)} identity providers...{Style.RESET_ALL}")
     for idp in idps:
+        if skip_existing("idps", idp) or is_done(("idps", idp["name"])):
+            continue
         idp_response = br.identity_management.identity_providers.create(
             name=idp["name"], description=idp["description"]
         )
         idp["id"] = idp_response["id"]
         idp["ssoConfig"] = idp_response["ssoConfig"]
+        cache_add("idps", idp["name"], idp["id"])
+        journal_record(("idps", idp["name"]), id=idp["id"], ssoConfig=idp["ssoConfig"])
         if idp["type"].lower() == "azure":
             br.identity_management.identity_providers.update(
                 identity_provider_id=idp_response["id"], sso_provider="Azure"
@@ -299,114 +1054,172 @@ def process_idps():
 
 
 def process_broker_pool():
+    if is_done(("brokerPool",)):
+        print(f"{info}Broker Pool already created - skipping{Style.RESET_ALL}")
+        return
     broker_pool = br.access_broker.pools.create(
         name="Primary Pool", description="Broker Pool for Britive Broker"
     )
+    journal_record(("brokerPool",), id=broker_pool["pool-id"])
     print(f"{green}Create Broker Pool id: {broker_pool['pool-id']}{Style.RESET_ALL}")
 
 
-def process_resource_types():
-    try:
-        rts = jmespath.search(expression="resourcesTypes", data=data)
-        if not rts:
-            print(f"{warn}No Resource Types found in the data.{Style.RESET_ALL}")
-            return
+def create_resource_type(rt):
+    # A resumed resource type keeps its id, only its children are processed
+    if is_done(("resourcesTypes", rt["name"])):
+        return
+    rt_response = br.access_broker.resources.types.create(
+        name=rt["name"], description=rt.get("description", "")
+    )
+    rt["id"] = rt_response["resourceTypeId"]
+    journal_record(("resourcesTypes", rt["name"]), id=rt["id"])
+    print(
+        f"{green}Created Resource-Type: {rt['name']} with id:{rt['id']} {Style.RESET_ALL}"
+    )
 
-        for rt in rts:
-            try:
-                rt_response = br.access_broker.resources.types.create(
-                    name=rt["name"], description=rt.get("description", "")
-                )
-                rt["id"] = rt_response["resourceTypeId"]
-                print(
-                    f"{green}Created Resource-Type: {rt['name']} with id:{rt['id']} {Style.RESET_ALL}"
-                )
-            except Exception as e:
-                print(
-                    f"{caution}Error creating Resource-Type {rt['name']}: {e}{Style.RESET_ALL}"
-                )
-                exit(1)  # Skip to the next resource type
 
-            # Process Permissions
-            try:
-                perms = jmespath.search(expression="permissions", data=rt) or []
-                print(
-                    f"{info}Creating Permissions {len(perms)} : {perms}{Style.RESET_ALL}"
+def create_permission(rt, perm):
+    path = ("resourcesTypes", rt["name"], "permissions", perm["name"])
+    if is_done(path):
+        return
+    perm_response = br.access_broker.resources.permissions.create(
+        name=perm["name"],
+        resource_type_id=rt["id"],
+        description=perm["description"],
+        variables=perm["variables"],
+        checkout_file=perm["checkout"],
+        checkin_file=perm["checkin"],
+    )
+    perm["id"] = perm_response["permissionId"]
+    journal_record(path, id=perm["id"])
+
+
+def create_resource(rt, resource):
+    path = ("resourcesTypes", rt["name"], "resources", resource["name"])
+    if is_done(path):
+        return
+    resource_response = br.access_broker.resources.create(
+        name=resource["name"],
+        description=resource["description"],
+        resource_type_id=rt["id"],
+    )
+    resource["id"] = resource_response["resourceId"]
+    journal_record(path, id=resource["id"])
+    print(
+        f"{green}Created Resource: {resource['name']} with id: {resource['id']}{Style.RESET_ALL}"
+    )
+
+
+def create_broker_profile(rt, profile):
+    path = ("resourcesTypes", rt["name"], "profiles", profile["name"])
+    if journal.get(path, {}).get("associated"):
+        return
+    # The profile may have been created before the association failed
+    if not is_done(path):
+        profile_response = br.access_broker.profiles.create(
+            name=profile["name"],
+            description=profile["description"],
+            expiration_duration=profile["Expiration"],
+        )
+        profile["id"] = profile_response["profileId"]
+        journal_record(path, id=profile["id"])
+        print(
+            f"{green}Created Profile: {profile['name']} with id: {profile['id']}{Style.RESET_ALL}"
+        )
+    # The association needs the profile, so it stays in the same task
+    assoc = {"Resource-Type": rt["name"]}
+    br.access_broker.profiles.add_association(
+        profile_id=profile["id"], associations=assoc
+    )
+    journal_record(path, associated=True)
+
+
+class ResourceTypeErrors(Exception):
+    # Raised once every resource type has been processed, when some items failed
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} Resource-Type items failed")
+        self.errors = errors
+
+
+def process_resource_types(max_workers=1):
+    rts = jmespath.search(expression="resourcesTypes", data=data)
+    if not rts:
+        print(f"{warn}No Resource Types found in the data.{Style.RESET_ALL}")
+        return
+
+    # Permissions, resources and profiles only depend on the id of their resource
+    # type, so they are submitted as soon as that type is created
+    children = [
+        ("permissions", "Permission", create_permission),
+        ("resources", "Resource", create_resource),
+        ("profiles", "Profile", create_broker_profile),
+    ]
+    errors = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+
+        def submit_children(rt):
+            found = {}
+            if existing:
+                # The permissions of a type created in this run need no listing
+                found = existing_resource_type_children(
+                    find_existing("resourcesTypes", rt["name"])
                 )
-                for perm in perms:
-                    try:
-                        perm_response = br.access_broker.resources.permissions.create(
-                            name=perm["name"],
-                            resource_type_id=rt["id"],
-                            description=perm["description"],
-                            variables=perm["variables"],
-                            checkout_file=perm["checkout"],
-                            checkin_file=perm["checkin"],
-                        )
-                        perm["id"] = perm_response["permissionId"]
-                    except Exception as e:
+            perms = rt.get("permissions") or []
+            print(
+                f"{info}Creating {len(perms)} Permissions for {rt['name']}{Style.RESET_ALL}"
+            )
+            for key, child_label, create in children:
+                for child in rt.get(key) or []:
+                    child_id = found.get(key, {}).get(child["name"])
+                    if child_id is not None:
+                        child["id"] = child_id
                         print(
-                            f"{caution}Error creating Permission {perm['name']}: {e}{Style.RESET_ALL}"
+                            f"{info}{child['name']} already exists - skipping{Style.RESET_ALL}"
                         )
-            except Exception as e:
-                print(
-                    f"{caution}Error processing permissions for {rt['name']}: {e}{Style.RESET_ALL}"
-                )
+                        continue
+                    future = executor.submit(create, rt, child)
+                    running[future] = (child_label, child, rt)
 
-            # Process Resources
-            try:
-                resources = jmespath.search(expression="resources", data=rt) or []
-                for resource in resources:
-                    try:
-                        resource_response = br.access_broker.resources.create(
-                            name=resource["name"],
-                            description=resource["description"],
-                            resource_type_id=rt["id"],
-                        )
-                        resource["id"] = resource_response["resourceId"]
-                        print(
-                            f"{green}Created Resource: {resource['name']} with id: {resource['id']}{Style.RESET_ALL}"
-                        )
-                    except Exception as e:
-                        print(
-                            f"{caution}Error creating Resource {resource['name']}: {e}{Style.RESET_ALL}"
-                        )
-            except Exception as e:
-                print(
-                    f"{caution}Error processing resources for {rt['name']}: {e}{Style.RESET_ALL}"
-                )
+        for rt in rts:
+            # An existing resource type keeps its id, a partial run may still have
+            # left some of its children out
+            if skip_existing("resourcesTypes", rt):
+                submit_children(rt)
+                continue
+            running[executor.submit(create_resource_type, rt)] = (
+                "Resource-Type",
+                rt,
+                rt,
+            )
 
-            # Process Profiles
-            try:
-                profiles = jmespath.search(expression="profiles", data=rt) or []
-                for profile in profiles:
-                    try:
-                        profile_response = br.access_broker.profiles.create(
-                            name=profile["name"],
-                            description=profile["description"],
-                            expiration_duration=profile["Expiration"],
-                        )
-                        profile["id"] = profile_response["profileId"]
-                        print(
-                            f"{green}Created Profile: {profile['name']} with id: {profile['id']}{Style.RESET_ALL}"
-                        )
-                        assoc = {"Resource-Type": rt["name"]}
-                        br.access_broker.profiles.add_association(
-                            profile_id=profile["id"], associations=assoc
-                        )
-                    except Exception as e:
-                        print(
-                            f"{caution}Error creating Profile {profile['name']}: {e}{Style.RESET_ALL}"
-                        )
-            except Exception as e:
-                print(
-                    f"{caution}Error processing profiles for {rt['name']}: {e}{Style.RESET_ALL}"
-                )
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                label, item, rt = running.pop(future)
+                try:
+                    future.result()
+                    item.pop("error", None)
+                except Exception as e:
+                    item["error"] = str(e)
+                    errors.append(f"{rt['name']} {label} {item.get('name')}: {e}")
+                    print(
+                        f"{caution}Error creating {label} {item.get('name')}: {e}{Style.RESET_ALL}"
+                    )
+                    continue
+                if item is rt:
+                    submit_children(rt)
 
-    except Exception as e:
+    if errors:
         print(
-            f"{caution}Unexpected error in process_resource_types: {e}{Style.RESET_ALL}"
+            f"{caution}{len(errors)} Resource-Type items failed, "
+            f"see the 'error' field of each item:{Style.RESET_ALL}"
         )
+        for error in errors:
+            print(f"  - {error}")
+        raise ResourceTypeErrors(errors)
+    else:
+        print(f"{green}All Resource-Types processed.{Style.RESET_ALL}")
 
 
 # Press the green button in the gutter to run the script.
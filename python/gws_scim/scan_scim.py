@@ -1,14 +1,248 @@
 import argparse
+import contextlib
+import contextvars
+import hashlib
+import itertools
 import json
 import logging
 import os
+import random
+import signal
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-from dotenv import load_dotenv
+import requests
 
 from britive.britive import Britive
 
 
+class Throttled(Exception):
+    """Raised for 429 responses while applying changes, so the apply can back off."""
+
+    def __init__(self, retry_after: float = None, response=None):
+        super().__init__("429 - too many requests")
+        self.retry_after = retry_after
+        self.response = response
+
+
+class ServerError(Exception):
+    """Raised for 5xx responses while applying changes, so the apply can back off."""
+
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} - server error")
+        self.status_code = response.status_code
+        self.response = response
+
+
+# the sdk sleeps about a minute retrying these before it gives up, while applying they
+# are raised at once and retried with the backoff of the apply instead
+SERVER_ERRORS = {500, 502, 503, 504}
+
+
+def raise_on_retryable(response, *args, **kwargs):
+    if response.status_code != 429 and response.status_code not in SERVER_ERRORS:
+        return
+    # read the body so the connection goes back to the pool before raising
+    response.content
+    if response.status_code in SERVER_ERRORS:
+        raise ServerError(response)
+    retry_after = response.headers.get("Retry-After", "")
+    raise Throttled(
+        float(retry_after) if retry_after.isdigit() else None, response=response
+    )
+
+
+RETRYABLE_ERRORS = (
+    Throttled,
+    ServerError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+@contextlib.contextmanager
+def retryable_errors_raised(b: Britive):
+    # the hook is on the session shared by every application, so it is installed once
+    # around all applies instead of by each of them
+    b.session.hooks["response"].append(raise_on_retryable)
+    try:
+        yield
+    finally:
+        b.session.hooks["response"].remove(raise_on_retryable)
+
+
+class TenantPause:
+    """Time until which every apply worker waits, as a 429 throttles the whole tenant."""
+
+    def __init__(self):
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        pause = self.resume_at - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def extend(self, delay: float):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+
+# bumped whenever the layout of plan files changes
+PLAN_VERSION = 1
+
+METRICS_NAMESPACE = "Britive/ScanScim"
+
+# statistics of the phase the current thread works on, copied into worker threads
+current_phase = contextvars.ContextVar("current_phase", default=None)
+phase_lock = threading.Lock()
+
+
+def count_api_call(response, *args, **kwargs):
+    stats = current_phase.get()
+    if stats is not None:
+        with phase_lock:
+            stats["api_calls"] += 1
+
+
+@contextlib.contextmanager
+def timed_phase(phases: dict, name: str):
+    # times the block and counts the api calls made in it, also from worker threads
+    # started with a copy of the context
+    stats = {"seconds": 0.0, "api_calls": 0, "objects": 0}
+    phases[name] = stats
+    token = current_phase.set(stats)
+    start = time.monotonic()
+    try:
+        yield stats
+    finally:
+        stats["seconds"] = round(time.monotonic() - start, 3)
+        current_phase.reset(token)
+
+
+def content_hash(value) -> str:
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, default=str).encode()
+    ).hexdigest()[:16]
+
+
+def write_json(path: str, value, **kwargs):
+    # write to a temporary file first so an interrupted run never leaves a torn file
+    with open(path + ".tmp", "w") as f:
+        json.dump(value, f, **kwargs)
+    os.replace(path + ".tmp", path)
+
+
+class FileSnapshotStore:
+    """Keeps sync snapshots as JSON files in a local directory."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def load(self, name: str) -> dict:
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def save(self, name: str, snapshot: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        write_json(os.path.join(self.directory, name), snapshot)
+
+
+class S3SnapshotStore:
+    """Keeps sync snapshots as JSON objects under an S3 prefix, e.g. for Lambda."""
+
+    def __init__(self, bucket: str, prefix: str = ""):
+        import boto3
+
+        self.s3 = boto3.client("s3")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def load(self, name: str) -> dict:
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self._key(name))
+        except self.s3.exceptions.NoSuchKey:
+            return {}
+        return json.loads(response["Body"].read())
+
+    def save(self, name: str, snapshot: dict) -> None:
+        self.s3.put_object(
+            Bucket=self.bucket, Key=self._key(name), Body=json.dumps(snapshot)
+        )
+
+
+class MemorySnapshotStore:
+    """Keeps sync snapshots in memory, for a daemon without a snapshot location."""
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def load(self, name: str) -> dict:
+        return self.snapshots.get(name, {})
+
+    def save(self, name: str, snapshot: dict) -> None:
+        self.snapshots[name] = snapshot
+
+
+def snapshot_store(location: str):
+    # any object with load(name) and save(name, snapshot) can be passed to ScanScim
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://") :].partition("/")
+        return S3SnapshotStore(bucket=bucket, prefix=prefix)
+    return FileSnapshotStore(directory=location)
+
+
+def get_snapshot_store(location: str):
+    # stores are kept for the life of the process, a daemon without a snapshot location
+    # keeps the snapshots in memory
+    if location not in snapshot_stores:
+        snapshot_stores[location] = (
+            snapshot_store(location) if location else MemorySnapshotStore()
+        )
+    return snapshot_stores[location]
+
+
+class TenantUser:
+    """Compact record of a tenant user, a tenant can have hundreds of thousands."""
+
+    __slots__ = ("username", "user_id", "status", "idp_id", "tags")
+
+    def __init__(
+        self, username: str, user_id: str, status: str, idp_id: str, tags: tuple = ()
+    ):
+        self.username = username
+        self.user_id = user_id
+        self.status = status
+        self.idp_id = idp_id
+        self.tags = tags
+
+
+class TenantSnapshot:
+    """Tenant users and tags collected in one pass and shared by every application."""
+
+    __slots__ = ("users", "tags", "local_users")
+
+    def __init__(self, users: list, tags: list, local_users: set):
+        self.users = users
+        self.tags = tags
+        self.local_users = local_users
+
+
+class AppLogger(logging.LoggerAdapter):
+    # prefixes messages with the application when several applications sync at once
+    def process(self, msg, kwargs):
+        return f"{self.extra['prefix']}{msg}", kwargs
+
+
 class ScanScim:
     def __init__(
         self,
@@ -19,17 +253,39 @@ class ScanScim:
         britive_tenant: str = None,
         britive_token: str = None,
         token_federation_provider: str = None,
+        max_workers: int = 8,
+        scan_timeout: int = 3600,
+        poll_interval: float = 1,
+        max_poll_interval: float = 30,
+        britive: Britive = None,
+        log_prefix: str = "",
+        snapshot_store=None,
+        full_sync_interval: int = 3600,
+        apply_workers: int = 8,
+        max_attempts: int = 6,
+        max_backoff: float = 60,
+        tenant_pause: TenantPause = None,
     ):
         self.application_users_group_name = application_users_group_name
         self.britive_group_prefix = britive_group_prefix
         self.application_id = application_id
         self.identity_provider_id = identity_provider_id
         self.britive_idp_name = "Britive"
-        self.b = Britive(
+        self.max_workers = max_workers
+        self.scan_timeout = scan_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timings = {}
+        self.phases = {}
+        self.logger = AppLogger(logging.getLogger(), {"prefix": log_prefix})
+        self.log_prefix = log_prefix
+        self.b = britive or Britive(
             tenant=britive_tenant,
             token=britive_token,
             token_federation_provider=token_federation_provider,
         )
+        if count_api_call not in self.b.session.hooks["response"]:
+            self.b.session.hooks["response"].append(count_api_call)
         self.scan_users = {}
         self.scan_groups = {}
         self.tenant_users = {}
@@ -40,7 +296,72 @@ class ScanScim:
         self.tags_to_create = []
         self.entitlements_to_create = {}
         self.entitlements_to_remove = {}
-        self.local_users = []
+        self.local_users = set()
+        self.snapshot_store = snapshot_store
+        self.full_sync_interval = full_sync_interval
+        self.snapshot_name = f"scan-scim-{application_id}.json"
+        self.previous = {}
+        self.full_sync = True
+        self.group_records = {}
+        self.group_members = {}
+        self.hashes = {}
+        self.apply_workers = apply_workers
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.tenant_pause = tenant_pause or TenantPause()
+
+    def load_snapshot(self):
+        # the state of the previous sync lets unchanged groups and users be skipped, a full
+        # sync is forced every full_sync_interval seconds
+        if not self.snapshot_store:
+            return
+        self.previous = self.snapshot_store.load(self.snapshot_name)
+        age = time.time() - self.previous.get("full_sync_at", 0)
+        self.full_sync = age > self.full_sync_interval
+        if self.full_sync:
+            self.logger.info("full sync, no recent snapshot of the previous sync")
+        else:
+            self.logger.info(
+                f"incremental sync against the snapshot from {age:.0f}s ago"
+            )
+
+    def save_snapshot(self):
+        if not self.snapshot_store:
+            return
+        now = time.time()
+        pending = set(self.entitlements_to_create) | set(self.entitlements_to_remove)
+        snapshot = {
+            "application_id": self.application_id,
+            "full_sync_at": (
+                now if self.full_sync else self.previous.get("full_sync_at", now)
+            ),
+            "synced_at": now,
+            "groups": {
+                name: {"record": self.group_records[name], "members": members}
+                for name, members in self.group_members.items()
+            },
+            "users": {
+                **self.hashes["users"],
+                "in_sync": not (
+                    self.users_to_create
+                    or self.users_to_enable
+                    or self.users_to_disable
+                ),
+            },
+            "entitlements": {
+                name: {**hashes, "in_sync": name not in pending}
+                for name, hashes in self.hashes["entitlements"].items()
+            },
+        }
+        self.snapshot_store.save(self.snapshot_name, snapshot)
+
+    def _unchanged(self, previous: dict, hashes: dict) -> bool:
+        # nothing was pending after the previous diff and neither side changed since
+        return (
+            bool(previous)
+            and previous["in_sync"]
+            and all(previous.get(k) == v for k, v in hashes.items())
+        )
 
     def _group_matches(self, name: str):
         return (
@@ -48,12 +369,23 @@ class ScanScim:
             or name.lower() == self.application_users_group_name.lower()
         )
 
-    def collect_local_users(self):
-        self.local_users = [
-            u["username"]
-            for u in self.b.identity_management.users.list()
-            if u["identityProvider"]["name"] == self.britive_idp_name
-        ]
+    def collect_local_users(self, snapshot: TenantSnapshot = None):
+        if snapshot is None:
+            snapshot = collect_tenant_snapshot(self.b, {self.identity_provider_id})
+        self.local_users = snapshot.local_users
+
+    def phase(self, name: str):
+        return timed_phase(self.phases, name)
+
+    def change_count(self) -> int:
+        return (
+            len(self.users_to_create)
+            + len(self.users_to_enable)
+            + len(self.users_to_disable)
+            + len(self.tags_to_create)
+            + sum(len(u) for u in self.entitlements_to_create.values())
+            + sum(len(u) for u in self.entitlements_to_remove.values())
+        )
 
     def _get_users_for_group(self, group_id: int) -> list:
         return [
@@ -63,58 +395,107 @@ class ScanScim:
             )
         ]
 
-    def _wait_for_task_to_complete(self, task_id: str, scan_type: str) -> None:
-        logging.info(f"waiting for {scan_type} scan to complete")
+    def _poll(self, check, description: str, deadline: float):
+        # calls check until it returns a value, probing quickly at first and then backing
+        # off exponentially with jitter so long scans do not hammer the api
+        start = time.monotonic()
+        interval = self.poll_interval
+        polls = 0
         while True:
+            polls += 1
+            result = check()
+            if result is not None:
+                elapsed = time.monotonic() - start
+                self.timings[description] = round(elapsed, 3)
+                self.logger.debug(
+                    f"{description} done in {elapsed:.1f}s after {polls} polls"
+                )
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception(
+                    f"timed out waiting for {description} after {self.scan_timeout} seconds"
+                )
+            sleep = min(random.uniform(interval / 2, interval), remaining)
+            self.logger.debug(
+                f"sleeping {sleep:.1f} seconds while waiting for {description}"
+            )
+            time.sleep(sleep)
+            interval = min(interval * 2, self.max_poll_interval)
+
+    def _wait_for_task_to_complete(
+        self, task_id: str, scan_type: str, deadline: float
+    ) -> None:
+        self.logger.info(f"waiting for {scan_type} scan to complete")
+
+        def check():
             response = self.b.application_management.scans.status(task_id=task_id)
             status = response["status"].lower()
             if status == "success":
-                logging.debug(f"{scan_type} scan complete")
-                break
+                return True
             if status == "error":
                 error = response["error"]
-                logging.debug(f"{scan_type} scan error: {error}")
+                self.logger.debug(f"{scan_type} scan error: {error}")
                 raise Exception(error)
-            logging.debug(
-                f"sleeping 10 seconds while waiting for {scan_type} scan to complete"
-            )
-            time.sleep(10)
+            return None
 
-    def _get_env_task_id_given_org_task_id(self, task_id: str) -> str:
-        env_scan_task_id = None
-        for scan in self.b.application_management.scans.history(
-            application_id=self.application_id
-        ):
-            if scan["orgTaskId"] == task_id:
-                env_scan_task_id = scan["taskId"]
-                break
-        if not env_scan_task_id:
-            raise Exception(
-                "unable to find environment scan task given org scan task id"
-            )
-        return env_scan_task_id
+        self._poll(check, description=f"{scan_type} scan", deadline=deadline)
+
+    def _get_env_task_id_given_org_task_id(self, task_id: str, deadline: float) -> str:
+        # the env scan task shows up in the history some time after the org scan completes
+        def check():
+            for scan in self.b.application_management.scans.history(
+                application_id=self.application_id
+            ):
+                if scan["orgTaskId"] == task_id:
+                    return scan["taskId"]
+            return None
+
+        return self._poll(check, description="env scan task", deadline=deadline)
 
     def scan_application(self):
-        logging.info("scanning application")
-        response = self.b.application_management.applications.scan(
-            application_id=self.application_id
-        )
+        self.logger.info("scanning application")
+        start = time.monotonic()
+        deadline = start + self.scan_timeout
+        with self.phase("scan"):
+            response = self.b.application_management.applications.scan(
+                application_id=self.application_id
+            )
         task_id = response["taskId"]
 
-        # this just waits for the org scan to complete
-        self._wait_for_task_to_complete(task_id=task_id, scan_type="org")
+        with self.phase("scan_wait"):
+            # this just waits for the org scan to complete
+            self._wait_for_task_to_complete(
+                task_id=task_id, scan_type="org", deadline=deadline
+            )
 
-        # now we need to wait for env scan task to be created
-        time.sleep(10)
-        env_scan_task_id = self._get_env_task_id_given_org_task_id(task_id=task_id)
+            # now we need to wait for env scan task to be created
+            env_scan_task_id = self._get_env_task_id_given_org_task_id(
+                task_id=task_id, deadline=deadline
+            )
 
-        # and finally wait for the task to complete
-        self._wait_for_task_to_complete(task_id=env_scan_task_id, scan_type="env")
+            # and finally wait for the task to complete
+            self._wait_for_task_to_complete(
+                task_id=env_scan_task_id, scan_type="env", deadline=deadline
+            )
 
-    def collect_scan_data(self):
-        logging.info("collecting scan data")
+        self.timings["scan"] = round(time.monotonic() - start, 3)
+        self.logger.info(
+            f"scan completed in {self.timings['scan']:.1f}s "
+            f"(org scan {self.timings['org scan']:.1f}s, "
+            f"env scan task {self.timings['env scan task']:.1f}s, "
+            f"env scan {self.timings['env scan']:.1f}s)"
+        )
+
+    def collect_scan_data(self, snapshot: TenantSnapshot = None):
+        with self.phase("collect_scan") as stats:
+            self._collect_scan_data(snapshot=snapshot)
+            stats["objects"] = len(self.scan_users) + len(self.scan_groups)
 
-        self.collect_local_users()
+    def _collect_scan_data(self, snapshot: TenantSnapshot = None):
+        self.logger.info("collecting scan data")
+
+        self.collect_local_users(snapshot=snapshot)
 
         groups = [
             g
@@ -131,19 +512,56 @@ class ScanScim:
                 break
         if not app_group:
             raise Exception("application users group not found")
-        app_group_users = [
+
+        # members of groups the scan reports as unchanged are reused from the previous
+        # sync, the application users group is always fetched. a group without a scan
+        # status is fetched too, unchanged has to be reported
+        previous_groups = {} if self.full_sync else self.previous.get("groups", {})
+        members = {}
+        for group in groups:
+            # the scan status changes from scan to scan, only the stable details count
+            self.group_records[group["name"]] = content_hash(
+                {k: group.get(k) for k in ("appPermissionId", "name", "description")}
+            )
+            previous = previous_groups.get(group["name"])
+            if (
+                group is not app_group
+                and previous
+                and previous["record"] == self.group_records[group["name"]]
+                and group.get("scanStatus", "").lower() == "unchanged"
+            ):
+                members[group["appPermissionId"]] = previous["members"]
+        to_fetch = [g for g in groups if g["appPermissionId"] not in members]
+
+        # each group membership is a separate paginated call so fetch them concurrently,
+        # the application users group is one of the matching groups
+        self.logger.debug(
+            f"collecting members of {len(to_fetch)} groups, "
+            f"reusing {len(members)} unchanged groups"
+        )
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                g["appPermissionId"]: executor.submit(
+                    contextvars.copy_context().run,
+                    self._get_users_for_group,
+                    g["appPermissionId"],
+                )
+                for g in to_fetch
+            }
+            members.update({k: f.result() for k, f in futures.items()})
+        self.group_members = {g["name"]: members[g["appPermissionId"]] for g in groups}
+
+        app_group_users = {
             u
-            for u in self._get_users_for_group(group_id=app_group["appPermissionId"])
+            for u in members[app_group["appPermissionId"]]
             if u not in self.local_users
-        ]
+        }
 
         for group in groups:
             name = group["name"]
 
             users = [
-                u
-                for u in self._get_users_for_group(group_id=group["appPermissionId"])
-                if u in app_group_users
+                u for u in members[group["appPermissionId"]] if u in app_group_users
             ]
             self.scan_groups[name] = {
                 "description": group["description"],
@@ -166,9 +584,16 @@ class ScanScim:
                 "lastName": account["lastName"],
             }
 
-    def collect_tenant_data(self):
-        logging.debug("collecting tenant data")
-        for tag in self.b.identity_management.tags.list():
+    def collect_tenant_data(self, snapshot: TenantSnapshot = None):
+        with self.phase("collect_tenant") as stats:
+            self._collect_tenant_data(snapshot=snapshot)
+            stats["objects"] = len(self.tenant_users) + len(self.tenant_groups)
+
+    def _collect_tenant_data(self, snapshot: TenantSnapshot = None):
+        self.logger.debug("collecting tenant data")
+        if snapshot is None:
+            snapshot = collect_tenant_snapshot(self.b, {self.identity_provider_id})
+        for tag in snapshot.tags:
             name = tag["name"]
             if not name.startswith(self.britive_group_prefix):
                 continue
@@ -179,57 +604,94 @@ class ScanScim:
                 continue
             self.tenant_groups[name] = {"id": tag["userTagId"], "users": []}
 
-        for user in self.b.identity_management.users.list(include_tags=True):
-            if user["identityProvider"]["id"] != self.identity_provider_id:
+        # the records are shared with the snapshot, nothing is copied per application
+        for user in snapshot.users:
+            if user.idp_id != self.identity_provider_id:
                 continue
-            username = user["username"]
-            self.tenant_users[username] = {
-                "username": username,
-                "email": user["email"],
-                "firstName": user["firstName"],
-                "lastName": user["lastName"],
-                "userId": user["userId"],
-                "status": user["status"],
-            }
-
-            user_tags = []
-            for tag in user.get("userTags", []):
-                name = tag["name"]
-                if not name.startswith(self.britive_group_prefix):
-                    continue
-                user_tags.append(name)
-                self.tenant_groups[name]["users"].append(username)
-
-            self.tenant_users[username]["tags"] = user_tags
+            self.tenant_users[user.username] = user
+            for name in user.tags:
+                if name.startswith(self.britive_group_prefix):
+                    self.tenant_groups[name]["users"].append(user.username)
 
     @staticmethod
     def _diff(source, compare):
-        lower_compare = [i.lower() for i in compare]
+        # items of source missing from compare, ignoring case, in source order
+        lower_compare = {i.lower() for i in compare}
         return [i for i in source if i.lower() not in lower_compare]
 
+    def _diff_hashes(self):
+        # content hashes of both sides of each diff, compared with the previous sync
+        def names(users) -> list:
+            return sorted(u.lower() for u in users)
+
+        self.hashes = {
+            "users": {
+                "scan": content_hash(names(self.scan_users)),
+                "tenant": content_hash(
+                    sorted((u.lower(), v.status) for u, v in self.tenant_users.items())
+                ),
+            },
+            "entitlements": {
+                name: {
+                    "scan": content_hash(
+                        names(self.scan_groups.get(name, {}).get("users", []))
+                    ),
+                    "tenant": content_hash(
+                        names(self.tenant_groups.get(name, {}).get("users", []))
+                    ),
+                }
+                for name in {**self.scan_groups, **self.tenant_groups}
+            },
+        }
+
     def diff(self):
-        logging.info("performing diff")
-        self.users_to_create = self._diff(
-            source=self.scan_users, compare=self.tenant_users
-        )
+        with self.phase("diff") as stats:
+            self._compute_diff()
+            stats["objects"] = self.change_count()
+
+    def _compute_diff(self):
+        self.logger.info("performing diff")
+        self._diff_hashes()
+        previous_entitlements = self.previous.get("entitlements", {})
+
+        if self._unchanged(self.previous.get("users"), self.hashes["users"]):
+            self.logger.info("users unchanged since the previous sync")
+        else:
+            self.users_to_create = self._diff(
+                source=self.scan_users, compare=self.tenant_users
+            )
 
-        active_users = [
-            u for u, v in self.tenant_users.items() if v["status"] == "active"
-        ]
+            active_users = [
+                u for u, v in self.tenant_users.items() if v.status == "active"
+            ]
 
-        self.users_to_disable = self._diff(source=active_users, compare=self.scan_users)
-        lower_scan_users = [i.lower() for i in self.scan_users]
-        self.users_to_enable = [
-            u
-            for u, v in self.tenant_users.items()
-            if v["status"] == "inactive" and u.lower() in lower_scan_users
-        ]
+            self.users_to_disable = self._diff(
+                source=active_users, compare=self.scan_users
+            )
+            lower_scan_users = {i.lower() for i in self.scan_users}
+            self.users_to_enable = [
+                u
+                for u, v in self.tenant_users.items()
+                if v.status == "inactive" and u.lower() in lower_scan_users
+            ]
 
         self.tags_to_create = self._diff(
             source=self.scan_groups, compare=self.tenant_groups
         )
 
+        unchanged = {
+            name
+            for name, hashes in self.hashes["entitlements"].items()
+            if self._unchanged(previous_entitlements.get(name), hashes)
+        }
+        if unchanged:
+            self.logger.info(
+                f"{len(unchanged)} groups unchanged since the previous sync"
+            )
+
         for group, details in self.scan_groups.items():
+            if group in unchanged:
+                continue
             tag_users = self.tenant_groups.get(group, {}).get("users", [])
             entitlements_to_create = self._diff(
                 source=details["users"], compare=tag_users
@@ -238,6 +700,8 @@ class ScanScim:
                 self.entitlements_to_create[group] = entitlements_to_create
 
         for tag, details in self.tenant_groups.items():
+            if tag in unchanged:
+                continue
             scan_users = self.scan_groups.get(tag, {}).get("users", [])
             entitlements_to_remove = self._diff(
                 source=details["users"], compare=scan_users
@@ -245,91 +709,501 @@ class ScanScim:
             if len(entitlements_to_remove) > 0:
                 self.entitlements_to_remove[tag] = entitlements_to_remove
 
-    def create_users(self):
-        logging.info("creating users")
-        if len(self.users_to_create) == 0:
-            logging.info("no users to create")
-        for username in self.users_to_create:
-            details = self.scan_users[username]
-
-            tenant_user = self.tenant_users.get(username, None)
-            if tenant_user:
-                if tenant_user["status"] == "active":
-                    logging.info(
-                        f"user {username} already exists and is active - skipping"
-                    )
-                if tenant_user["status"] == "inactive":
-                    self.b.identity_management.users.enable(
-                        user_id=tenant_user["userId"]
-                    )
-                    logging.info(
-                        f"user {username} already exists and was inactive - made active"
-                    )
-                    continue
-
-            response = self.b.identity_management.users.create(
-                idp=self.identity_provider_id, **details
+    def log_changes(self):
+        self.logger.info(
+            f"users to create: {json.dumps(self.users_to_create, default=str)}"
+        )
+        self.logger.info(
+            f"users to enable: {json.dumps(self.users_to_enable, default=str)}"
+        )
+        self.logger.info(
+            f"tags to create: {json.dumps(self.tags_to_create, default=str)}"
+        )
+        self.logger.info(
+            f"entitlements to create: {json.dumps(self.entitlements_to_create, default=str)}"
+        )
+        self.logger.info(
+            f"users to disable: {json.dumps(self.users_to_disable, default=str)}"
+        )
+        self.logger.info(
+            f"entitlements to remove: {json.dumps(self.entitlements_to_remove, default=str)}"
+        )
+
+    def to_plan(self) -> dict:
+        # the changes with the tenant ids they need, so they can be applied later without
+        # collecting the scan and tenant data again
+        usernames = {
+            *self.users_to_create,
+            *self.users_to_enable,
+            *self.users_to_disable,
+        }
+        tag_names = set(self.tags_to_create)
+        for changes in (self.entitlements_to_create, self.entitlements_to_remove):
+            tag_names.update(changes)
+            for users in changes.values():
+                usernames.update(users)
+        return {
+            "users_to_create": {u: self.scan_users[u] for u in self.users_to_create},
+            "users_to_enable": self.users_to_enable,
+            "tags_to_create": self.tags_to_create,
+            "entitlements_to_create": self.entitlements_to_create,
+            "entitlements_to_remove": self.entitlements_to_remove,
+            "users_to_disable": self.users_to_disable,
+            "user_ids": {
+                u: [self.tenant_users[u].user_id, self.tenant_users[u].status]
+                for u in sorted(usernames)
+                if u in self.tenant_users
+            },
+            "tag_ids": {
+                n: self.tenant_groups[n]["id"]
+                for n in sorted(tag_names)
+                if n in self.tenant_groups
+            },
+        }
+
+    def load_plan(self, plan: dict):
+        self.scan_users = plan["users_to_create"]
+        self.users_to_create = list(plan["users_to_create"])
+        self.users_to_enable = plan["users_to_enable"]
+        self.tags_to_create = plan["tags_to_create"]
+        self.entitlements_to_create = plan["entitlements_to_create"]
+        self.entitlements_to_remove = plan["entitlements_to_remove"]
+        self.users_to_disable = plan["users_to_disable"]
+        self.tenant_users = {
+            u: TenantUser(
+                username=u,
+                user_id=user_id,
+                status=status,
+                idp_id=self.identity_provider_id,
             )
-            new_fields = {
-                "userId": response["userId"],
-                "status": response["status"],
-            }
-            self.tenant_users[username] = {**details, **new_fields}
-            logging.info(f"created user {username} with user id {response['userId']}")
+            for u, (user_id, status) in plan["user_ids"].items()
+        }
+        self.tenant_groups = {
+            n: {"id": tag_id, "users": []} for n, tag_id in plan["tag_ids"].items()
+        }
+
+    def apply(self) -> dict:
+        # phases run in order, users before tags before entitlements, each phase with
+        # bounded concurrency; failures are collected per item instead of aborting. run
+        # inside retryable_errors_raised, 429 and 5xx are retried here instead of the sdk
+        results = {}
+        for step in (
+            self.create_users,
+            self.enable_users,
+            self.create_tags,
+            self.create_entitlements,
+            self.remove_entitlements,
+            self.disable_users,
+        ):
+            with self.phase(step.__name__) as stats:
+                results[step.__name__] = step()
+                stats["objects"] = len(results[step.__name__]["succeeded"])
+                stats["failed"] = len(results[step.__name__]["failed"])
+        return results
+
+    def _call_with_backoff(self, func, *args):
+        attempt = 0
+        while True:
+            # every worker of every application waits while the tenant is throttling
+            self.tenant_pause.wait()
+            try:
+                return func(*args)
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                delay = min(self.max_backoff, 2**attempt)
+                if isinstance(e, Throttled) and e.retry_after:
+                    delay = max(delay, e.retry_after)
+                delay = random.uniform(delay / 2, delay)
+                if isinstance(e, Throttled):
+                    self.tenant_pause.extend(delay)
+                else:
+                    # a server or connection error only holds back its own change
+                    time.sleep(delay)
+                self.logger.debug(
+                    f"{type(e).__name__} on attempt {attempt}, retrying in {delay:.1f}s"
+                )
 
-    def create_tags(self):
-        logging.info("creating tags")
-        if len(self.tags_to_create) == 0:
-            logging.info("no tags to create")
-        for name in self.tags_to_create:
-            response = self.b.identity_management.tags.create(name=name)
-            self.tenant_groups[name] = {
-                "id": response["userTagId"],
-                "users": [],
+    def _run_phase(self, items: list, func) -> dict:
+        result = {"succeeded": [], "failed": []}
+        with ThreadPoolExecutor(max_workers=self.apply_workers) as executor:
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run, self._call_with_backoff, func, *item
+                ): item
+                for item in items
             }
-            logging.info(f"created tag {name} with tag id {response['userTagId']}")
+            for future in as_completed(futures):
+                item = list(futures[future])
+                try:
+                    future.result()
+                    result["succeeded"].append(item)
+                except Exception as e:
+                    self.logger.error(f"{func.__name__} failed for {item}: {e}")
+                    result["failed"].append({"item": item, "error": str(e)})
+        return result
+
+    def _user_id(self, username: str) -> str:
+        user = self.tenant_users.get(username)
+        if not user:
+            raise Exception(f"user {username} does not exist in the tenant")
+        return user.user_id
+
+    def _tag_id(self, name: str) -> str:
+        tag = self.tenant_groups.get(name)
+        if not tag or "id" not in tag:
+            raise Exception(f"tag {name} does not exist in the tenant")
+        return tag["id"]
+
+    def create_users(self) -> dict:
+        self.logger.info("creating users")
+        if len(self.users_to_create) == 0:
+            self.logger.info("no users to create")
+        return self._run_phase([(u,) for u in self.users_to_create], self._create_user)
 
-    def create_entitlements(self):
-        logging.info("creating entitlements")
-        if len(self.entitlements_to_create) == 0:
-            logging.info("no entitlements to create")
-        for tag_name, usernames in self.entitlements_to_create.items():
-            tag_id = self.tenant_groups[tag_name]["id"]
-            for username in usernames:
-                user_id = self.tenant_users[username]["userId"]
-                self.b.identity_management.tags.add_user(tag_id=tag_id, user_id=user_id)
-                logging.info(f"added {username} to {tag_name}")
-
-    def remove_entitlements(self):
-        logging.info("removing entitlements")
-        if len(self.entitlements_to_create) == 0:
-            logging.info("no entitlements to remove")
-        for tag_name, usernames in self.entitlements_to_remove.items():
-            tag_id = self.tenant_groups[tag_name]["id"]
-            for username in usernames:
-                user_id = self.tenant_users[username]["userId"]
-                self.b.identity_management.tags.remove_user(
-                    tag_id=tag_id, user_id=user_id
+    def _create_user(self, username: str):
+        details = self.scan_users[username]
+
+        tenant_user = self.tenant_users.get(username, None)
+        if tenant_user:
+            if tenant_user.status == "active":
+                self.logger.info(
+                    f"user {username} already exists and is active - skipping"
                 )
-                logging.info(f"removed {username} to {tag_name}")
+            if tenant_user.status == "inactive":
+                self.b.identity_management.users.enable(user_id=tenant_user.user_id)
+                self.logger.info(
+                    f"user {username} already exists and was inactive - made active"
+                )
+                return
+
+        response = self.b.identity_management.users.create(
+            idp=self.identity_provider_id, **details
+        )
+        self.tenant_users[username] = TenantUser(
+            username=username,
+            user_id=response["userId"],
+            status=response["status"],
+            idp_id=self.identity_provider_id,
+        )
+        self.logger.info(f"created user {username} with user id {response['userId']}")
+
+    def create_tags(self) -> dict:
+        self.logger.info("creating tags")
+        if len(self.tags_to_create) == 0:
+            self.logger.info("no tags to create")
+        return self._run_phase([(n,) for n in self.tags_to_create], self._create_tag)
+
+    def _create_tag(self, name: str):
+        response = self.b.identity_management.tags.create(name=name)
+        self.tenant_groups[name] = {
+            "id": response["userTagId"],
+            "users": [],
+        }
+        self.logger.info(f"created tag {name} with tag id {response['userTagId']}")
+
+    def create_entitlements(self) -> dict:
+        self.logger.info("creating entitlements")
+        if len(self.entitlements_to_create) == 0:
+            self.logger.info("no entitlements to create")
+        return self._run_phase(
+            [
+                (tag_name, username)
+                for tag_name, usernames in self.entitlements_to_create.items()
+                for username in usernames
+            ],
+            self._add_tag_user,
+        )
+
+    def _add_tag_user(self, tag_name: str, username: str):
+        self.b.identity_management.tags.add_user(
+            tag_id=self._tag_id(tag_name), user_id=self._user_id(username)
+        )
+        self.logger.info(f"added {username} to {tag_name}")
+
+    def remove_entitlements(self) -> dict:
+        self.logger.info("removing entitlements")
+        if len(self.entitlements_to_remove) == 0:
+            self.logger.info("no entitlements to remove")
+        return self._run_phase(
+            [
+                (tag_name, username)
+                for tag_name, usernames in self.entitlements_to_remove.items()
+                for username in usernames
+            ],
+            self._remove_tag_user,
+        )
 
-    def disable_users(self):
-        logging.info("disabling users")
+    def _remove_tag_user(self, tag_name: str, username: str):
+        self.b.identity_management.tags.remove_user(
+            tag_id=self._tag_id(tag_name), user_id=self._user_id(username)
+        )
+        self.logger.info(f"removed {username} from {tag_name}")
+
+    def disable_users(self) -> dict:
+        self.logger.info("disabling users")
         if len(self.users_to_disable) == 0:
-            logging.info("no users to disable")
-        for username in self.users_to_disable:
-            user_id = self.tenant_users[username]["userId"]
-            self.b.identity_management.users.disable(user_id=user_id)
-            logging.info(f"disabled user {username}")
-
-    def enable_users(self):
-        logging.info("enabling users")
+            self.logger.info("no users to disable")
+        return self._run_phase(
+            [(u,) for u in self.users_to_disable], self._disable_user
+        )
+
+    def _disable_user(self, username: str):
+        self.b.identity_management.users.disable(user_id=self._user_id(username))
+        self.logger.info(f"disabled user {username}")
+
+    def enable_users(self) -> dict:
+        self.logger.info("enabling users")
         if len(self.users_to_enable) == 0:
-            logging.info("no users to enable")
-        for username in self.users_to_enable:
-            user_id = self.tenant_users[username]["userId"]
-            self.b.identity_management.users.enable(user_id=user_id)
-            logging.info(f"enabled user {username}")
+            self.logger.info("no users to enable")
+        return self._run_phase([(u,) for u in self.users_to_enable], self._enable_user)
+
+    def _enable_user(self, username: str):
+        self.b.identity_management.users.enable(user_id=self._user_id(username))
+        self.logger.info(f"enabled user {username}")
+
+
+# state kept at module level is reused by warm invocations of the lambda handler
+britive_client = None
+tenant_cache = {"at": 0.0, "snapshot": None, "idp_ids": frozenset()}
+snapshot_stores = {}
+logging_configured = False
+invocations = 0
+last_metrics = None
+daemon_state = {
+    "cycles": 0,
+    "failed_cycles": 0,
+    "last_success": None,
+    "last_error": None,
+}
+
+
+def get_britive() -> Britive:
+    global britive_client
+    if britive_client is None:
+        britive_client = Britive()
+    return britive_client
+
+
+def iter_pages(b: Britive, url: str, params: dict, size: int = 100):
+    # yields the items of an inline paginated listing one page at a time, where the sdk
+    # would first collect every page into one list
+    page = 0
+    while True:
+        result = b.get(
+            url, params={**params, "page": page, "size": size}, pagination="none"
+        )
+        yield from result["data"]
+        if size * (page + 1) >= result["count"]:
+            break
+        page += 1
+
+
+def collect_tenant_snapshot(
+    b: Britive, idp_ids: set, britive_idp_name: str = "Britive"
+) -> TenantSnapshot:
+    # one pass over the users with their tags gives the local users, and compact records
+    # of the users of the given identity providers
+    logging.info("collecting tenant snapshot")
+    users = []
+    local_users = set()
+    for user in iter_pages(
+        b,
+        b.identity_management.users.base_url,
+        params={"type": "User", "includeTags": "true"},
+    ):
+        idp = user["identityProvider"]
+        if idp["name"] == britive_idp_name:
+            local_users.add(user["username"])
+        if idp["id"] not in idp_ids:
+            continue
+        users.append(
+            TenantUser(
+                username=user["username"],
+                user_id=user["userId"],
+                status=sys.intern(user["status"]),
+                idp_id=sys.intern(idp["id"]),
+                tags=tuple(sys.intern(t["name"]) for t in user.get("userTags", [])),
+            )
+        )
+    return TenantSnapshot(
+        users=users, tags=b.identity_management.tags.list(), local_users=local_users
+    )
+
+
+def cached_tenant_snapshot(b: Britive, idp_ids: set, ttl: int) -> TenantSnapshot:
+    # reuses the snapshot of a previous run for ttl seconds, runs that change the tenant
+    # update it with their changes. the snapshot only has the users of the identity
+    # providers it was collected for, so a run that adds one collects it again
+    age = time.monotonic() - tenant_cache["at"]
+    if (
+        ttl > 0
+        and tenant_cache["snapshot"] is not None
+        and age < ttl
+        and tenant_cache["idp_ids"] >= set(idp_ids)
+    ):
+        logging.info(f"using the tenant snapshot from {age:.0f}s ago")
+        return tenant_cache["snapshot"]
+    snapshot = collect_tenant_snapshot(b, idp_ids)
+    if ttl > 0:
+        tenant_cache.update(
+            at=time.monotonic(), snapshot=snapshot, idp_ids=frozenset(idp_ids)
+        )
+    return snapshot
+
+
+def update_tenant_cache(scims: list, results: dict):
+    # applies the changes that succeeded to the cached tenant snapshot, so the next run
+    # can reuse it instead of listing the tenant again; the tenant users are shared with
+    # the applications, so their records are updated in place
+    snapshot = tenant_cache["snapshot"]
+    if snapshot is None:
+        return
+    # a failed change may or may not have been made, and new tags only come with a full
+    # listing, so the snapshot is collected again instead
+    if any(
+        phase["failed"] for result in results.values() for phase in result.values()
+    ) or any(result["create_tags"]["succeeded"] for result in results.values()):
+        tenant_cache["snapshot"] = None
+        return
+
+    existing = {u.username for u in snapshot.users}
+    for scim in scims:
+        result = results[scim.application_id]
+        for (username,) in result["create_users"]["succeeded"]:
+            user = scim.tenant_users[username]
+            if username in existing:
+                # an inactive user is enabled instead of created again
+                user.status = "active"
+            else:
+                snapshot.users.append(user)
+        for (username,) in result["enable_users"]["succeeded"]:
+            scim.tenant_users[username].status = "active"
+        for (username,) in result["disable_users"]["succeeded"]:
+            scim.tenant_users[username].status = "inactive"
+        for tag, username in result["create_entitlements"]["succeeded"]:
+            user = scim.tenant_users[username]
+            user.tags = user.tags + (sys.intern(tag),)
+        for tag, username in result["remove_entitlements"]["succeeded"]:
+            user = scim.tenant_users[username]
+            user.tags = tuple(t for t in user.tags if t != tag)
+    logging.info("updated the cached tenant snapshot with the applied changes")
+
+
+def load_apps(apps_file: str) -> list:
+    # applications to sync, keys missing from an entry in the apps file fall back to the
+    # environment variables of the same name
+    keys = ("APP_GROUP", "GROUP_PREFIX", "APP_ID", "IDP_ID")
+    if not apps_file:
+        return [{key: os.environ[key] for key in keys}]
+
+    with open(apps_file) as f:
+        apps = [
+            {key: app.get(key, os.environ.get(key)) for key in keys}
+            for app in json.load(f)
+        ]
+    if not apps:
+        raise Exception(f"no applications found in {apps_file}")
+    for app in apps:
+        missing = [key for key in keys if not app[key]]
+        if missing:
+            raise Exception(
+                f"application {app['APP_ID']} is missing {', '.join(missing)}"
+            )
+    for key in ("APP_ID", "IDP_ID"):
+        values = [app[key] for app in apps]
+        if len(set(values)) != len(values):
+            raise Exception(f"every application in {apps_file} needs its own {key}")
+    # an application syncs every tag that starts with its prefix, so it must not match
+    # the groups of another application or both would sync the same tags
+    for app, other in itertools.permutations(apps, 2):
+        prefix = app["GROUP_PREFIX"].lower()
+        if (
+            other["GROUP_PREFIX"].lower().startswith(prefix)
+            or other["APP_GROUP"].lower().startswith(prefix)
+            or other["APP_GROUP"].lower() == app["APP_GROUP"].lower()
+        ):
+            raise Exception(
+                f"the groups of applications {app['APP_ID']} and {other['APP_ID']} "
+                f"overlap, every application in {apps_file} needs its own GROUP_PREFIX "
+                "and APP_GROUP"
+            )
+    return apps
+
+
+def write_plan(plan_file: str, plan: dict):
+    write_json(plan_file, plan, separators=(",", ":"))
+    logging.info(f"wrote plan for {len(plan['apps'])} applications to {plan_file}")
+
+
+def read_plan(plan_file: str, b: Britive) -> dict:
+    with open(plan_file) as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise Exception(f"{plan_file} is not a plan written by this version")
+    if plan["tenant"] != b.tenant:
+        raise Exception(f"{plan_file} was planned for tenant {plan['tenant']}")
+    logging.info(
+        f"applying plan from {time.time() - plan['created']:.0f}s ago in {plan_file}"
+    )
+    return plan
+
+
+def metrics_record(tenant: str, run: dict, seconds: float, failed: bool) -> dict:
+    # one record per run in the cloudwatch embedded metric format, the phases of the
+    # applications are added up, durations take the slowest application as they run
+    # concurrently
+    phases = {}
+    for app_phases in [run["phases"], *run["apps"].values()]:
+        for name, stats in app_phases.items():
+            total = phases.setdefault(
+                name, {"seconds": 0.0, "api_calls": 0, "objects": 0, "failed": 0}
+            )
+            total["seconds"] = max(total["seconds"], stats["seconds"])
+            total["api_calls"] += stats["api_calls"]
+            total["objects"] += stats["objects"]
+            total["failed"] += stats.get("failed", 0)
+
+    values = {
+        "Duration": round(seconds, 3),
+        "ApiCalls": sum(p["api_calls"] for p in phases.values()),
+        "FailedChanges": sum(p["failed"] for p in phases.values()),
+        "FailedRuns": int(failed),
+    }
+    units = {"Duration": "Seconds"}
+    for name, stats in phases.items():
+        metric = name.title().replace("_", "")
+        values[f"{metric}Duration"] = stats["seconds"]
+        values[f"{metric}ApiCalls"] = stats["api_calls"]
+        values[f"{metric}Objects"] = stats["objects"]
+        units[f"{metric}Duration"] = "Seconds"
+
+    return {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Tenant"]],
+                    "Metrics": [
+                        {"Name": name, "Unit": units.get(name, "Count")}
+                        for name in values
+                    ],
+                }
+            ],
+        },
+        "Tenant": tenant,
+        **values,
+        "phases": phases,
+        "applications": run["apps"],
+    }
+
+
+def emit_metrics(record: dict):
+    # printed as a bare json line on stdout, which is where cloudwatch looks for embedded
+    # metrics in lambda; log messages go to stderr
+    print(json.dumps(record, separators=(",", ":")), flush=True)
 
 
 def confirm():
@@ -339,7 +1213,7 @@ def confirm():
         return user_input == "yes"
 
 
-def build_args():
+def build_args(argv: list = None):
     parser = argparse.ArgumentParser(
         description="Python script to simulate SCIM actions based on Britive scan data."
     )
@@ -361,91 +1235,405 @@ def build_args():
         help="Absolute path for where to emit log entries to file. Omitting means nothing will log to a file.",
     )
 
-    return parser.parse_args()
+    parser.add_argument(
+        "-w",
+        "--max-workers",
+        default=8,
+        type=int,
+        help="Number of group memberships to collect concurrently.",
+    )
+
+    parser.add_argument(
+        "--scan-timeout",
+        default=3600,
+        type=int,
+        help="Seconds to wait for the application scan to complete before giving up.",
+    )
+
+    parser.add_argument(
+        "-a",
+        "--apps-file",
+        default=os.environ.get("APPS_FILE"),
+        help="JSON file listing several applications to sync in one run. Defaults to the single application in the environment.",
+    )
+
+    parser.add_argument(
+        "-s",
+        "--snapshot",
+        default=os.environ.get("SNAPSHOT_LOCATION"),
+        help="Directory or s3://bucket/prefix to keep the state of the previous sync in, for incremental syncs.",
+    )
+
+    parser.add_argument(
+        "--full-sync-interval",
+        default=3600,
+        type=int,
+        help="Seconds after which an incremental sync fetches every group again.",
+    )
+
+    parser.add_argument(
+        "--apply-workers",
+        default=8,
+        type=int,
+        help="Number of changes to apply concurrently within each phase.",
+    )
+
+    parser.add_argument(
+        "--tenant-cache-ttl",
+        default=int(os.environ.get("TENANT_CACHE_TTL", 0)),
+        type=int,
+        help="Seconds to reuse the tenant users and tags between runs in the same process, e.g. warm Lambda invocations. 0 disables the cache, except in daemon mode where it defaults to --interval.",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Print the duration, API calls and objects of every phase as one JSON record in the CloudWatch embedded metric format at the end of the run.",
+    )
+
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and sync every --interval seconds, with the client and caches kept warm between syncs.",
+    )
+
+    parser.add_argument(
+        "--interval",
+        default=int(os.environ.get("SYNC_INTERVAL", 300)),
+        type=int,
+        help="Seconds between the start of two syncs in daemon mode.",
+    )
+
+    parser.add_argument(
+        "--health-port",
+        default=int(os.environ.get("HEALTH_PORT", 0)),
+        type=int,
+        help="Port to serve /health and /metrics on in daemon mode. 0 disables the endpoint.",
+    )
+
+    parser.add_argument(
+        "--health-host",
+        default="127.0.0.1",
+        help="Address to serve /health and /metrics on in daemon mode.",
+    )
+
+    plan = parser.add_mutually_exclusive_group()
+    plan.add_argument(
+        "--plan",
+        metavar="PLAN_FILE",
+        help="Write the changes to this file for review instead of applying them.",
+    )
+    plan.add_argument(
+        "--apply",
+        metavar="PLAN_FILE",
+        help="Apply the changes in a file written by --plan, without collecting the scan and tenant data again.",
+    )
+
+    args = parser.parse_args(argv)
+    if args.daemon and (args.plan or args.apply):
+        parser.error("--daemon cannot be combined with --plan or --apply")
+    return args
 
 
 def configure_logging(log_file: str):
+    global logging_configured
+
     log_formatter = logging.Formatter("%(asctime)s %(levelname)-8s %(message)s")
     root_logger = logging.getLogger()
     root_logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
+    # handlers are added once per process, warm lambda invocations would duplicate them
+    if logging_configured:
+        return
+    logging_configured = True
+    # the lambda runtime already sends the root logger to cloudwatch
+    add_console_handler = not root_logger.handlers
+
     if log_file:
         file_handler = logging.FileHandler(log_file)
         file_handler.setFormatter(log_formatter)
         root_logger.addHandler(file_handler)
 
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(log_formatter)
-    root_logger.addHandler(console_handler)
-
+    if add_console_handler:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(log_formatter)
+        root_logger.addHandler(console_handler)
 
-def process():
-    load_dotenv()
 
-    args = build_args()
+def collect(scims: list, b: Britive, args: argparse.Namespace, phases: dict):
+    # the tenant snapshot is collected while the applications scan, so the run takes as
+    # long as the slowest application instead of the sum of all of them
+    def tenant_snapshot() -> TenantSnapshot:
+        with timed_phase(phases, "tenant_snapshot") as stats:
+            snapshot = cached_tenant_snapshot(
+                b, {s.identity_provider_id for s in scims}, args.tenant_cache_ttl
+            )
+            stats["objects"] = len(snapshot.users) + len(snapshot.tags)
+            return snapshot
+
+    with ThreadPoolExecutor(max_workers=len(scims) + 1) as executor:
+        snapshot = executor.submit(tenant_snapshot)
+
+        def prepare(scan_scim: ScanScim):
+            scan_scim.load_snapshot()
+            scan_scim.scan_application()
+            tenant = snapshot.result()
+            scan_scim.collect_scan_data(snapshot=tenant)
+            scan_scim.collect_tenant_data(snapshot=tenant)
+            scan_scim.diff()
+            scan_scim.log_changes()
+            scan_scim.save_snapshot()
+
+        for future in [executor.submit(prepare, s) for s in scims]:
+            future.result()
+
+
+def sync(args: argparse.Namespace, b: Britive, run: dict):
+    plan = read_plan(args.apply, b) if args.apply else None
+    apps = [a["app"] for a in plan["apps"]] if plan else load_apps(args.apps_file)
+    store = get_snapshot_store(args.snapshot) if args.snapshot or args.daemon else None
+    tenant_pause = TenantPause()
+    scims = [
+        ScanScim(
+            application_users_group_name=app["APP_GROUP"],
+            britive_group_prefix=app["GROUP_PREFIX"],
+            application_id=app["APP_ID"],
+            identity_provider_id=app["IDP_ID"],
+            max_workers=args.max_workers,
+            scan_timeout=args.scan_timeout,
+            britive=b,
+            log_prefix=f"[{app['APP_ID']}] " if len(apps) > 1 else "",
+            snapshot_store=store,
+            full_sync_interval=args.full_sync_interval,
+            apply_workers=args.apply_workers,
+            tenant_pause=tenant_pause,
+        )
+        for app in apps
+    ]
+    run["apps"] = {s.application_id: s.phases for s in scims}
+
+    if plan:
+        for scan_scim, app_plan in zip(scims, plan["apps"]):
+            scan_scim.load_plan(app_plan)
+            scan_scim.log_changes()
+    else:
+        collect(scims, b, args, run["phases"])
+
+    if args.plan:
+        plan = {
+            "version": PLAN_VERSION,
+            "tenant": b.tenant,
+            "created": time.time(),
+            "apps": [{"app": app, **s.to_plan()} for app, s in zip(apps, scims)],
+        }
+        write_plan(args.plan, plan)
+        return plan
+
+    for scan_scim in scims:
+        if (
+            len(scan_scim.users_to_disable)
+            > args.num_allowable_users_to_disable_before_error
+        ):
+            raise Exception(
+                f"{scan_scim.log_prefix}performing actions would result in more than "
+                f"{args.num_allowable_users_to_disable_before_error} to be disabled so not "
+                "performing any actions"
+            )
 
-    configure_logging(log_file=args.log_file)
+    if args.confirm and not confirm():
+        return
 
-    logging.info("starting processing")
+    with retryable_errors_raised(b), ThreadPoolExecutor(
+        max_workers=len(scims)
+    ) as executor:
+        futures = {s.application_id: executor.submit(s.apply) for s in scims}
+    results = {app_id: future.result() for app_id, future in futures.items()}
+
+    for app_id, result in results.items():
+        succeeded = sum(len(phase["succeeded"]) for phase in result.values())
+        failed = sum(len(phase["failed"]) for phase in result.values())
+        prefix = f"[{app_id}] " if len(results) > 1 else ""
+        if failed:
+            logging.error(f"{prefix}applied {succeeded} changes, {failed} failed")
+        else:
+            logging.info(f"{prefix}applied {succeeded} changes")
+    if args.apply:
+        tenant_cache["snapshot"] = None
+    else:
+        update_tenant_cache(scims, results)
+    return results
+
+
+def process(args: argparse.Namespace = None):
+    global last_metrics
+
+    if args is None:
+        # only the command line reads a .env file, so lambda does not need python-dotenv
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        args = build_args()
 
-    scan_scim = ScanScim(
-        application_users_group_name=os.environ["APP_GROUP"],
-        britive_group_prefix=os.environ["GROUP_PREFIX"],
-        application_id=os.environ["APP_ID"],
-        identity_provider_id=os.environ["IDP_ID"],
-    )
+    configure_logging(log_file=args.log_file)
 
-    scan_scim.scan_application()
-    scan_scim.collect_scan_data()
-    scan_scim.collect_tenant_data()
-    scan_scim.diff()
+    if args.daemon:
+        return run_daemon(args)
 
-    logging.info(
-        f"users to create: {json.dumps(scan_scim.users_to_create, default=str)}"
-    )
-    logging.info(
-        f"users to enable: {json.dumps(scan_scim.users_to_enable, default=str)}"
-    )
-    logging.info(f"tags to create: {json.dumps(scan_scim.tags_to_create, default=str)}")
-    logging.info(
-        f"entitlements to create: {json.dumps(scan_scim.entitlements_to_create, default=str)}"
-    )
-    logging.info(
-        f"users to disable: {json.dumps(scan_scim.users_to_disable, default=str)}"
-    )
-    logging.info(
-        f"entitlements to remove: {json.dumps(scan_scim.entitlements_to_remove, default=str)}"
-    )
+    logging.info("starting processing")
 
-    if (
-        len(scan_scim.users_to_disable)
-        > args.num_allowable_users_to_disable_before_error
-    ):
-        raise Exception(
-            "performing actions would result in more than "
-            f"{args.num_allowable_users_to_disable_before_error} to be disabled so not "
-            "performing any actions"
+    b = get_britive()
+    run = {"phases": {}, "apps": {}}
+    start = time.monotonic()
+    failed = False
+    try:
+        return sync(args, b, run)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        last_metrics = metrics_record(b.tenant, run, time.monotonic() - start, failed)
+        if args.metrics:
+            emit_metrics(last_metrics)
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """Serves /health and /metrics of the daemon."""
+
+    def do_GET(self):
+        if self.path == "/health":
+            healthy = daemon_state["last_error"] is None
+            status = "ok" if daemon_state["last_success"] else "starting"
+            body = json.dumps(
+                {**daemon_state, "status": status if healthy else "failing"}
+            )
+            self._send(200 if healthy else 503, "application/json", body)
+        elif self.path == "/metrics":
+            self._send(200, "text/plain; version=0.0.4", prometheus_metrics())
+        else:
+            self._send(404, "text/plain", "not found\n")
+
+    def _send(self, status: int, content_type: str, body: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        logging.debug(f"health endpoint: {format % args}")
+
+
+def prometheus_metrics() -> str:
+    lines = [
+        "# TYPE scan_scim_cycles_total counter",
+        f"scan_scim_cycles_total {daemon_state['cycles']}",
+        "# TYPE scan_scim_failed_cycles_total counter",
+        f"scan_scim_failed_cycles_total {daemon_state['failed_cycles']}",
+        "# TYPE scan_scim_last_success_timestamp_seconds gauge",
+        f"scan_scim_last_success_timestamp_seconds {daemon_state['last_success'] or 0}",
+    ]
+    if last_metrics:
+        phases = last_metrics["phases"]
+        lines += [
+            "# TYPE scan_scim_last_run_duration_seconds gauge",
+            f"scan_scim_last_run_duration_seconds {last_metrics['Duration']}",
+        ]
+        for name, key in (
+            ("scan_scim_phase_duration_seconds", "seconds"),
+            ("scan_scim_phase_api_calls", "api_calls"),
+            ("scan_scim_phase_objects", "objects"),
+            ("scan_scim_phase_failed", "failed"),
+        ):
+            lines.append(f"# TYPE {name} gauge")
+            lines += [
+                f'{name}{{phase="{phase}"}} {stats[key]}'
+                for phase, stats in phases.items()
+            ]
+    return "\n".join(lines) + "\n"
+
+
+def run_daemon(args: argparse.Namespace):
+    # runs a sync every interval seconds in one process, so the client, the tenant
+    # snapshot and the sync snapshots stay warm between cycles
+    cycle_args = argparse.Namespace(**{**vars(args), "daemon": False, "confirm": False})
+    # the cached tenant only sees the changes of this process, so by default no cycle
+    # uses a listing older than one interval
+    if not cycle_args.tenant_cache_ttl:
+        cycle_args.tenant_cache_ttl = args.interval
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    server = None
+    if args.health_port:
+        server = ThreadingHTTPServer(
+            (args.health_host, args.health_port), HealthHandler
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(
+            f"serving /health and /metrics on http://{args.health_host}:{args.health_port}"
         )
 
-    if args.confirm and not confirm():
-        return
-
-    scan_scim.create_users()
-    scan_scim.enable_users()
-    scan_scim.create_tags()
-    scan_scim.create_entitlements()
-    scan_scim.remove_entitlements()
-    scan_scim.disable_users()
+    logging.info(f"syncing every {args.interval} seconds")
+    while not stop.is_set():
+        start = time.monotonic()
+        daemon_state["cycles"] += 1
+        try:
+            process(args=cycle_args)
+            daemon_state["last_success"] = time.time()
+            daemon_state["last_error"] = None
+        except Exception as e:
+            daemon_state["failed_cycles"] += 1
+            daemon_state["last_error"] = str(e)
+            logging.error(str(e))
+        # cycles start every interval seconds, a cycle that overruns is followed at once
+        stop.wait(max(0.0, args.interval - (time.monotonic() - start)))
+
+    logging.info("stopping")
+    if server:
+        server.shutdown()
 
 
 # lambda handler - in case this is run inside an AWS Lambda function - otherwise ignore/remove
 def handler(event, context):
+    # the client, logging and tenant cache are kept between warm invocations and there is
+    # nobody to confirm the changes
+    global invocations
+    invocations += 1
+    start = time.monotonic()
     try:
-        process()
+        results = process(args=build_args(["--no-confirm"]))
+        # only the counts are returned, the changes of a large sync would not fit in the
+        # 6 MB response limit of lambda; failed changes are in the log
+        return {
+            app_id: {
+                step: {
+                    "succeeded": len(result["succeeded"]),
+                    "failed": len(result["failed"]),
+                }
+                for step, result in app_results.items()
+            }
+            for app_id, app_results in (results or {}).items()
+        }
     except Exception as e:
         logging.error(str(e))
+    finally:
+        logging.info(
+            f"invocation {invocations} ({'cold' if invocations == 1 else 'warm'} start) "
+            f"took {time.monotonic() - start:.1f}s"
+        )
 
 
 # run from command line
 if __name__ == "__main__":
-    handler(None, None)
+    try:
+        results = process()
+    except Exception as e:
+        logging.error(str(e))
+        sys.exit(1)
+    # changes that failed are logged by sync, the exit code lets a scheduler see them
+    if results and any(
+        phase["failed"] for result in results.values() for phase in result.values()
+    ):
+        sys.exit(1)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Opt-in call instrumentation for the Britive SDK.
+
+Records, per endpoint and per calling function, how many API calls were made, how
+long they took, how many were retried by the SDK (429/5xx) and how many failed.
+Every HTTP attempt is measured, so paginated listings and SDK retries show up as
+separate calls.
+
+Wrap a single client with `instrument(client)`, or run an unmodified script with
+every Britive client instrumented:
+
+    python metrics/britive_metrics.py -o metrics.prom -- britive/setup.py --users
+"""
+
+import argparse
+import json
+import os
+import re
+import runpy
+import sys
+import threading
+import time
+from array import array
+from urllib.parse import urlparse
+
+# Prometheus style histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Path segments that look like ids: UUIDs, numbers, Britive ids and e-mail addresses
+ID_SEGMENT = re.compile(r"^(?=.*\d)[A-Za-z0-9_-]{8,}$|^\d+$|@")
+
+SCRIPT_FILE = None
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.started = time.time()
+
+    def record(
+        self, endpoint: str, caller: str, seconds: float, retried: bool, failed: bool
+    ) -> None:
+        with self.lock:
+            entry = self.endpoints.get((endpoint, caller))
+            if entry is None:
+                entry = {
+                    "latencies": array("d"),
+                    "buckets": [0] * len(BUCKETS),
+                    "retries": 0,
+                    "errors": 0,
+                }
+                self.endpoints[(endpoint, caller)] = entry
+            entry["latencies"].append(seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+                    break
+            if retried:
+                entry["retries"] += 1
+            if failed:
+                entry["errors"] += 1
+
+    def reset(self) -> None:
+        with self.lock:
+            self.endpoints = {}
+            self.started = time.time()
+
+    def summary(self) -> list:
+        # One row per endpoint and caller, slowest total first
+        with self.lock:
+            items = [
+                (key, dict(v, latencies=sorted(v["latencies"])))
+                for key, v in self.endpoints.items()
+            ]
+        rows = []
+        for (endpoint, caller), v in items:
+            latencies = v["latencies"]
+            rows.append(
+                {
+                    "endpoint": endpoint,
+                    "caller": caller,
+                    "calls": len(latencies),
+                    "retries": v["retries"],
+                    "errors": v["errors"],
+                    "error_rate": round(v["errors"] / len(latencies), 4),
+                    "seconds": round(sum(latencies), 3),
+                    "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                    "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+                    "max_ms": round(latencies[-1] * 1000, 1),
+                    "buckets": dict(zip(BUCKETS, v["buckets"])),
+                }
+            )
+        return sorted(rows, key=lambda r: r["seconds"], reverse=True)
+
+    def table(self) -> str:
+        rows = self.summary()
+        width = max([len(r["endpoint"]) for r in rows] + [8])
+        caller_width = max([len(r["caller"]) for r in rows] + [6])
+        lines = [
+            f"{'endpoint':<{width}}  {'caller':<{caller_width}}{'calls':>8}{'retries':>9}"
+            f"{'errors':>8}{'total s':>10}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        ]
+        for r in rows:
+            lines.append(
+                f"{r['endpoint']:<{width}}  {r['caller']:<{caller_width}}{r['calls']:>8}"
+                f"{r['retries']:>9}{r['errors']:>8}{r['seconds']:>10.1f}"
+                f"{r['p50_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}"
+            )
+        calls = sum(r["calls"] for r in rows)
+        api_seconds = sum(r["seconds"] for r in rows)
+        lines.append(
+            f"{calls} API calls, {sum(r['retries'] for r in rows)} retried, "
+            f"{sum(r['errors'] for r in rows)} failed, {api_seconds:.1f}s in API calls "
+            f"over {time.time() - self.started:.1f}s"
+        )
+        return "\n".join(lines)
+
+    def to_json(self) -> str:
+        rows = self.summary()
+        for r in rows:
+            r["buckets"] = {str(bound): count for bound, count in r["buckets"].items()}
+        return json.dumps(
+            {"started": self.started, "ended": time.time(), "endpoints": rows}, indent=2
+        )
+
+    def to_prometheus(self) -> str:
+        # Textfile collector format, cumulative buckets as Prometheus expects
+        lines = [
+            "# HELP britive_api_request_duration_seconds Britive API call latency.",
+            "# TYPE britive_api_request_duration_seconds histogram",
+        ]
+        counters = []
+        for r in self.summary():
+            labels = f'endpoint="{r["endpoint"]}",caller="{r["caller"]}"'
+            cumulative = 0
+            for bound, count in r["buckets"].items():
+                cumulative += count
+                lines.append(
+                    f'britive_api_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'britive_api_request_duration_seconds_bucket{{{labels},le="+Inf"}} {r["calls"]}'
+            )
+            lines.append(
+                f"britive_api_request_duration_seconds_sum{{{labels}}} {r['seconds']}"
+            )
+            lines.append(
+                f"britive_api_request_duration_seconds_count{{{labels}}} {r['calls']}"
+            )
+            counters.append((labels, r))
+        for name, key, text in (
+            ("britive_api_retries_total", "retries", "Calls retried by the SDK."),
+            ("britive_api_errors_total", "errors", "Calls that failed."),
+        ):
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} counter")
+            lines += [f"{name}{{{labels}}} {r[key]}" for labels, r in counters]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        content = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        # Write to a temporary file first so a collector never reads a torn file
+        with open(path + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+
+
+metrics = Metrics()
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def endpoint_name(method: str, url: str) -> str:
+    path = urlparse(url).path
+    if "/api/" in path:
+        path = path.split("/api", 1)[1]
+    segments = ["{id}" if ID_SEGMENT.search(s) else s for s in path.split("/")]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+def caller_name() -> str:
+    # Innermost named function of the instrumented script on the stack, e.g. create_user
+    frame = sys._getframe(2)
+    while frame:
+        code = frame.f_code
+        in_script = code.co_filename == SCRIPT_FILE or (
+            SCRIPT_FILE is None and "site-packages" not in code.co_filename
+        )
+        if in_script and (code.co_name == "<module>" or code.co_name[0] != "<"):
+            return code.co_name
+        frame = frame.f_back
+    return "-"
+
+
+def instrument(client):
+    """Record every API call made by a Britive client in the module level metrics."""
+    session = client.session
+    if getattr(session, "instrumented", False):
+        return client
+    request = session.request
+    retry_statuses = getattr(client, "retry_response_status", {429, 500, 502, 503, 504})
+
+    def instrumented_request(method, url, *args, **kwargs):
+        caller = caller_name()
+        start = time.perf_counter()
+        try:
+            response = request(method, url, *args, **kwargs)
+        except Exception as e:
+            # response hooks may raise for retryable statuses, e.g. while scan_scim.py
+            # applies changes, those are still retries and not errors
+            status = getattr(getattr(e, "response", None), "status_code", None)
+            metrics.record(
+                endpoint_name(method, url),
+                caller,
+                time.perf_counter() - start,
+                status in retry_statuses,
+                status not in retry_statuses,
+            )
+            raise
+        status = response.status_code
+        metrics.record(
+            endpoint_name(method, url),
+            caller,
+            time.perf_counter() - start,
+            status in retry_statuses,
+            status >= 400 and status not in retry_statuses,
+        )
+        return response
+
+    session.request = instrumented_request
+    session.instrumented = True
+    return client
+
+
+def instrument_all() -> None:
+    """Instrument every Britive client created after this call."""
+    import britive.britive as sdk
+
+    init = sdk.Britive.__init__
+    if getattr(init, "instrumented", False):
+        return
+
+    def __init__(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        instrument(self)
+
+    __init__.instrumented = True
+    sdk.Britive.__init__ = __init__
+
+
+def report(output: str = None, quiet: bool = False) -> None:
+    if not quiet:
+        print(metrics.table(), file=sys.stderr)
+    if output:
+        metrics.write(output)
+
+
+def main():
+    global SCRIPT_FILE
+
+    parser = argparse.ArgumentParser(
+        description="Run a script with every Britive API call instrumented.",
+        usage="%(prog)s [options] -- script.py [script arguments]",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Also write the metrics to this file, JSON for *.json, otherwise Prometheus text",
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="Do not print the summary table"
+    )
+    parser.add_argument("script", help="Script to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Script arguments")
+    args = parser.parse_args()
+
+    SCRIPT_FILE = os.path.abspath(args.script)
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(SCRIPT_FILE))
+    instrument_all()
+    try:
+        runpy.run_path(args.script, run_name="__main__")
+    finally:
+        report(args.output, args.quiet)
+
+
+if __name__ == "__main__":
+    main()